@@ -1,32 +1,45 @@
-from picamera import PiCamera
-import RPi.GPIO as GPIO
-from time import sleep
-import time
-import datetime
 import os
 import sys
+import threading
 from shutil import copyfile
 
-GPIO.setmode(GPIO.BOARD)
-GPIO.setup(29, GPIO.OUT)
-
-camera = PiCamera()
-
+from fluopi.acquisition import (run_timelapse, load_sequence, FrameWriter, CaptureLog,
+                                queue, CAPTURE_LOG)
+from fluopi.hardware import get_gpio, get_camera
 
 # Parameters for the user to modify
 # Basic settings
-if len(sys.argv)==5:
+if len(sys.argv) in (5,6,7):
     folder = str(sys.argv[1])            # e.g. Timelapse
     filename = str(sys.argv[2])          # e.g. im_exp1
     interval = int(sys.argv[3])     # wait time in seconds e.g. 1800
     steps = int(sys.argv[4])        # number of images   e.g 200
+    # capture mode: 'file' saves each image to the SD card,
+    # 'memory' captures to memory, analyses the frames online and saves them in background,
+    # 'memory-nosave' is 'memory' without saving the image files
+    mode = str(sys.argv[5]) if len(sys.argv)>=6 else 'file'
+    # acquisition sequence: JSON file with a list of LED/exposure configurations
+    # captured on each cycle, e.g. [{"name": "blue", "pin": 29, "shutter_speed": 200000}]
+    configs = load_sequence(sys.argv[6]) if len(sys.argv)==7 else None
 else:
     print ("Required parameters: folder name, filename, interval (secs), number of steps.")
+    print ("Optional parameters: capture mode (file, memory or memory-nosave), sequence file.")
     sys.exit()
     
 print('folder = ' + folder + '\nfilename = ' + filename +  
-      '\ninterval = ' + str(interval) + ' sec'+ '\nsteps = '+ str(steps))
+      '\ninterval = ' + str(interval) + ' sec'+ '\nsteps = '+ str(steps) +
+      '\nmode = ' + mode)
  
+# Camera and GPIO of the Raspberry Pi
+# (run with FLUOPI_BACKEND=sim to use the simulated hardware)
+GPIO = get_gpio()
+GPIO.setmode(GPIO.BOARD)
+GPIO.setup(29, GPIO.OUT)
+for config in (configs or []):
+    GPIO.setup(config.get('pin', 29), GPIO.OUT)
+
+camera = get_camera(gpio=GPIO)
+
 # make the folder if it doesn't exist
 if os.path.exists(folder) == False:
     os.mkdir(folder)
@@ -59,31 +72,37 @@ camera.awb_mode = 'off'
 scriptpath = os.path.dirname(os.path.realpath(__file__))
 copyfile(os.path.join(scriptpath, sys.argv[0]), os.path.join(folder, 'script.py'))
 
-# Run the timelapse loop
-    
-for i in range(steps):
-    
-    t1 = time.time()
-    print('Cycle ' + str(i))
-    
-    # turn the LEDs on            
-    GPIO.output(29,GPIO.HIGH)
+# In memory modes the frames go straight to the online analysis
+frames = None
+writer = None
+if mode.startswith('memory'):
+    from fluopi.daemon import AnalysisDaemon
+    frames = queue.Queue()
+    if mode == 'memory':
+        writer = FrameWriter()
+    analysis = AnalysisDaemon(folder)
+    consumer = threading.Thread(target=analysis.consume, args=(frames,))
+    consumer.start()
 
-    datestr = datetime.datetime.now().strftime("%Y-%m-%d-%H_%M_%S")
-    fname = os.path.join(folder, datestr + "_" + filename + "_%04d.jpg"%(i))
-    camera.capture(fname)
-    
-    #turn the LEDs off
-    GPIO.output(29,GPIO.LOW)
+# Run the timelapse loop, on an absolute schedule
+# (files and capture metadata are written in background)
+if writer is None and mode == 'file':
+    writer = FrameWriter()
+log = CaptureLog(os.path.join(folder, CAPTURE_LOG))
 
-    elapsed = time.time()-t1
+run_timelapse(camera, GPIO, 29, folder, filename, interval, steps, frames, writer, log,
+              configs=configs)
+
+# print some relevant information
+print('Effective camera shutter speed :' + str(camera.shutter_speed) + '\n')
+# if the effective shutter speed doesnt coincide with the one you set,
+# you must modify the camera.framerate parameter.
+
+if frames is not None:
+    frames.put(None)
+    consumer.join()
+if writer is not None:
+    writer.close()
+log.close()
 
-    # print some relevant information
-    print('Elapsed cycle time: ' + str(elapsed))
-    print('Effective camera shutter speed :' + str(camera.shutter_speed) + '\n')
-    # if the effective shutter speed doesnt coincide with the one you set,
-    # you must modify the camera.framerate parameter.
-    
-    sleep(interval-elapsed) ##  waiting time between cycles
-    
 GPIO.cleanup()
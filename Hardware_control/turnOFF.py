@@ -1,9 +1,12 @@
 #to run: python turnOFF.py GPIO_number
 #where GPIO_number have to be an integer. e.g. 29
 
-import RPi.GPIO as GPIO
 import sys
 
+from fluopi.hardware import get_gpio
+
+GPIO = get_gpio()     # FLUOPI_BACKEND=sim to use a fake GPIO
+
 # Set the GPIO number where LEDs control is conected
 if len(sys.argv)==2:
     GPIO_num = int(sys.argv[1])            # e.g. Timelapse
@@ -0,0 +1,326 @@
+"""
+Image acquisition helpers used by Hardware_control/timelapse.py
+"""
+import os
+import io
+import time
+import json
+import datetime
+import threading
+import numpy as np
+from PIL import Image
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Per-frame metadata index written in the experiment folder (see CaptureLog)
+CAPTURE_LOG = 'capture_log.csv'
+
+# Camera attributes which can be set on each acquisition configuration
+CAMERA_SETTINGS = ['shutter_speed', 'ISO', 'framerate', 'awb_gains', 'brightness',
+                   'contrast']
+
+
+def capture_array(camera):
+    """
+    Capture an image directly to memory as an RGB array, without the JPEG
+    encoding and decoding round trip
+
+    Parameters
+    ----------
+    camera : PiCamera like object
+        camera with resolution attribute and capture(output, format) method
+
+    Returns
+    -------
+    im: array_like
+        (H,W,3) uint8 image data, same layout as plt.imread of a captured file
+    """
+    w,h = camera.resolution
+    # the camera fills buffers padded to 32 columns and 16 rows
+    buf = np.empty((int((h+15)/16)*16, int((w+31)/32)*32, 3), dtype=np.uint8)
+    camera.capture(buf, 'rgb')
+    return(buf[:h,:w,:])
+
+
+class FrameWriter(object):
+    """
+    Save frames as image files on a background thread. Files are written
+    with a temporary name and renamed when complete, so an analysis reading
+    the folder never gets a partially written image.
+
+    Parameters
+    ----------
+    quality : int
+        JPEG quality of the saved files
+    """
+
+    def __init__(self, quality=95):
+        self.quality = quality
+        self.queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, fname, im):
+        """
+        Queue a frame (image array or encoded image bytes) to be saved as fname
+        """
+        self.queue.put((fname, im))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            fname, im = item
+            tmp = fname + '.part'
+            if isinstance(im, bytes):       # already encoded image
+                with open(tmp, 'wb') as f:
+                    f.write(im)
+            else:
+                Image.fromarray(im).save(tmp, format='JPEG', quality=self.quality)
+            os.rename(tmp, fname)
+
+    def close(self):
+        """
+        Wait until all the queued frames are written
+        """
+        self.queue.put(None)
+        self._thread.join()
+
+
+def frame_name(folder, filename, i, date=None):
+    """
+    Name of the i-th frame of a time-lapse, with the date stamp at the
+    beginning (format used by file_timestamp)
+    """
+    if date is None:
+        date = datetime.datetime.now()
+    datestr = date.strftime("%Y-%m-%d-%H_%M_%S")
+    return(os.path.join(folder, datestr + "_" + filename + "_%04d.jpg"%(i)))
+
+
+def capture_cycle(camera, gpio, pin, fname, frames=None, writer=None):
+    """
+    Take one time-lapse frame: turn the LEDs on, capture and turn them off.
+    By default the image is captured to the file fname, or to a JPEG in
+    memory written asynchronously if a FrameWriter is given. If a frames
+    queue is given the image is captured to memory and (fname, timestamp, im)
+    is put in the queue, e.g. to be consumed by AnalysisDaemon.consume(); the
+    file is then written asynchronously only if a FrameWriter is given.
+
+    Parameters
+    ----------
+    camera : PiCamera like object
+        camera used for the capture
+
+    gpio : RPi.GPIO like module
+        GPIO interface controlling the LEDs
+
+    pin : int
+        GPIO pin of the LEDs
+
+    fname : string
+        file name of the frame
+
+    frames : Queue
+        queue receiving the in-memory frames (None to capture to file)
+
+    writer : FrameWriter
+        writer saving the in-memory frames (None to not save them)
+
+    Returns
+    -------
+    ts : double
+        capture time (seconds since the epoch)
+    """
+    gpio.output(pin, gpio.HIGH)
+    ts = time.time()
+    if frames is not None:
+        im = capture_array(camera)
+    elif writer is not None:
+        stream = io.BytesIO()
+        camera.capture(stream, 'jpeg')
+        im = stream.getvalue()
+    else:
+        camera.capture(fname)
+    gpio.output(pin, gpio.LOW)
+
+    if frames is not None:
+        frames.put((fname, ts, im))
+    if writer is not None:
+        writer.write(fname, im)
+    return(ts)
+
+
+class CaptureLog(object):
+    """
+    Append the metadata of each captured frame to a CSV file on a background
+    thread, so the capture loop never waits for the disk
+
+    Parameters
+    ----------
+    fname : string
+        path of the CSV file
+    """
+    FIELDS = ['frame', 'file', 'timestamp', 'scheduled', 'delay', 'config', 'pin',
+              'shutter_speed', 'ISO']
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.queue = queue.Queue()
+        if not os.path.exists(fname):
+            with open(fname, 'w') as f:
+                f.write(','.join(self.FIELDS) + '\n')
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def log(self, **values):
+        """
+        Queue the metadata of a frame (keywords on CaptureLog.FIELDS)
+        """
+        self.queue.put(values)
+
+    def _run(self):
+        while True:
+            values = self.queue.get()
+            if values is None:
+                break
+            with open(self.fname, 'a') as f:
+                f.write(','.join(str(values.get(k, '')) for k in self.FIELDS) + '\n')
+
+    def close(self):
+        """
+        Wait until all the queued lines are written
+        """
+        self.queue.put(None)
+        self._thread.join()
+
+
+def apply_config(camera, config):
+    """
+    Apply the camera settings of an acquisition configuration, changing only
+    the ones which differ from the current camera values (the camera is not
+    reinitialised between the captures of a sequence)
+
+    Parameters
+    ----------
+    camera : PiCamera like object
+        camera used for the captures
+
+    config : dictionary
+        acquisition configuration, keys on CAMERA_SETTINGS are applied
+    """
+    for key in CAMERA_SETTINGS:
+        if key in config and getattr(camera, key, None) != config[key]:
+            setattr(camera, key, config[key])
+
+
+def load_sequence(fname):
+    """
+    Load a list of acquisition configurations from a JSON file, e.g.:
+    [{"name": "blue", "pin": 29, "shutter_speed": 200000, "ISO": 400},
+     {"name": "white", "pin": 31, "shutter_speed": 20000}]
+    """
+    with open(fname) as f:
+        configs = json.load(f)
+    for i in range(len(configs)):
+        configs[i].setdefault('name', 'c%d'%i)
+    return(configs)
+
+
+def run_timelapse(camera, gpio, pin, folder, filename, interval, steps, frames=None,
+                  writer=None, log=None, clock=None, sleep=time.sleep,
+                  configs=None):
+    """
+    Run a time-lapse keeping the captures on an absolute schedule: frame i is
+    taken interval*i seconds after the start (monotonic clock), so the
+    capture time does not accumulate drift. If a capture is late the next one
+    is taken immediately, without negative waits.
+
+    With a list of acquisition configurations (configs) each cycle captures
+    a burst with one frame per configuration (LED pin and camera settings,
+    see apply_config), named with the configuration name after filename.
+    Only the frames of the first configuration go to the frames queue.
+    The camera settings which a configuration does not set keep the values
+    the camera had before the time-lapse, not the ones of the previous
+    configuration.
+
+    Parameters
+    ----------
+    camera : PiCamera like object
+        camera used for the captures
+
+    gpio : RPi.GPIO like module
+        GPIO interface controlling the LEDs
+
+    pin : int
+        GPIO pin of the LEDs
+
+    folder, filename : string
+        where and with which name to save the frames (see frame_name)
+
+    interval : double
+        time between captures (secs)
+
+    steps : int
+        number of frames
+
+    frames, writer:
+        in-memory capture queue and background file writer (see capture_cycle)
+
+    log : CaptureLog
+        log receiving the metadata of each frame
+
+    clock, sleep : functions
+        monotonic clock and sleep functions (replaceable for testing),
+        default clock = time.monotonic (time.time on python 2)
+
+    configs : list
+        acquisition configurations (dictionaries with 'name', 'pin' and
+        camera settings), None to capture one frame per cycle with pin
+
+    Returns
+    -------
+    T: array_like
+        actual capture time of each frame (seconds since the epoch),
+        T[frame, configuration] when configs are given
+    """
+    seq = configs if configs is not None else [{'name': '', 'pin': pin}]
+    # initial values of the settings changed by any configuration
+    base = dict((key, getattr(camera, key)) for key in CAMERA_SETTINGS
+                if hasattr(camera, key) and any(key in config for config in seq))
+    T = np.zeros((steps, len(seq)))
+    if clock is None:
+        clock = getattr(time, 'monotonic', time.time)
+    t0 = clock()
+    for i in range(steps):
+        scheduled = t0 + i*interval
+        wait = scheduled - clock()
+        if wait > 0:
+            sleep(wait)
+
+        delay = clock() - scheduled
+        print('Cycle ' + str(i))
+        for k in range(len(seq)):
+            config = dict(base, **seq[k])
+            apply_config(camera, config)
+            name = filename + '_' + config['name'] if config['name'] else filename
+            fname = frame_name(folder, name, i)
+            T[i,k] = capture_cycle(camera, gpio, config.get('pin', pin), fname,
+                                   frames if k == 0 else None, writer)
+            if log is not None:
+                log.log(frame=i, file=os.path.basename(fname), timestamp=T[i,k],
+                        scheduled=i*interval, delay=delay, config=config['name'],
+                        pin=config.get('pin', pin),
+                        shutter_speed=getattr(camera, 'shutter_speed', ''),
+                        ISO=getattr(camera, 'ISO', ''))
+        print('Elapsed cycle time: ' + str(clock() - scheduled - delay))
+
+    if configs is None:
+        return(T[:,0])
+    return(T)
@@ -3,17 +3,30 @@ import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import glob
+import os
+import re
+import datetime
+import time
 import pickle as pkl
 
+from PIL import Image
 from skimage.filters import gaussian
 import skimage.feature as skfeat
 from math import pi
 
 from scipy.optimize import curve_fit
 
+# Per-frame metadata index written by timelapse.py in the experiment folder
+from fluopi.acquisition import CAPTURE_LOG
+
 # Define the image channels
 CHANNELS = ['R','G','B']
 
+# Date stamp written by Hardware_control/timelapse.py at the start of each filename
+TIMESTAMP_FORMAT = '%Y-%m-%d-%H_%M_%S'
+TIMESTAMP_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2}-\d{2}_\d{2}_\d{2})')
+
+
 
 def save_obj(obj, name, folder ):
     """
@@ -87,7 +100,194 @@ def count_files(path,file_type):
     print(path.split('\\')[-1]+' = '+str(ImageCount) + ' files')
     return(ImageCount)
 
-def get_im_data(x_frames,image_count,f_name, init = 0):
+
+def file_timestamp(f_name):
+    """
+    Get the acquisition time of an image file. The date stamp written by
+    timelapse.py at the beginning of the filename is used when present, then
+    the EXIF date of the image, otherwise the file modification time is
+    returned.
+
+    Parameters
+    ----------
+    f_name : string
+        full path of the image file
+
+    Returns
+    -------
+    ts : double
+        acquisition time in seconds since the epoch
+
+    """
+    match = TIMESTAMP_PATTERN.match(os.path.basename(f_name))
+    if match:
+        date = datetime.datetime.strptime(match.group(1), TIMESTAMP_FORMAT)
+        return(time.mktime(date.timetuple()))
+    try:
+        exif = Image.open(f_name).getexif()
+        stamp = exif.get_ifd(0x8769).get(36867) or exif.get(306)   # DateTimeOriginal, DateTime
+        if stamp:
+            date = datetime.datetime.strptime(stamp.strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+            return(time.mktime(date.timetuple()))
+    except (KeyError, ValueError, TypeError, AttributeError, OSError):
+        pass                # no EXIF date or not readable
+    return(os.path.getmtime(f_name))
+
+
+def timestamp_index(path, file_type='jpg', refresh=False, config=None):
+    """
+    Index of acquisition times of the image files of a folder, taken from
+    the folder manifest (see fluopi.manifest.build_manifest), which is
+    cached on the folder and updated incrementally, so the new files of a
+    growing capture folder are always included. The times recorded by
+    timelapse.py on the capture log are used when available, otherwise they
+    are obtained with file_timestamp. On a sequenced time-lapse only the
+    files of one acquisition configuration are included.
+
+    Parameters
+    ----------
+    path : string
+        folder name where the images are stored
+
+    file_type : string
+        extension of the image files (e.g. tif, png, jpg)
+
+    refresh : boolean
+        True to rebuild the index from scratch, discarding the cached manifest
+
+    config : string
+        name of the acquisition configuration (see get_manifest_data),
+        default = the first configuration of the sequence
+
+    Returns
+    -------
+    index: dictionary
+        index['Files']: file names in frame order, index['Index']: frame
+        number of each file (position in name order when the names have no
+        frame number), index['Timestamps']: acquisition time of each file
+        (seconds since the epoch)
+
+    """
+    from fluopi.manifest import build_manifest, manifest_name, frame_selection
+
+    cached = os.path.join(path, manifest_name(file_type) + '.pkl')
+    if refresh and os.path.exists(cached):
+        os.remove(cached)
+    manifest = build_manifest(path, file_type)
+    idx, use = frame_selection(manifest, config)
+    sel = np.nonzero(use & (idx >= 0))[0]
+    sel = sel[np.argsort(idx[sel], kind='stable')]
+    index = {'Files': [manifest['Files'][i] for i in sel], 'Index': idx[sel],
+             'Timestamps': manifest['Timestamps'][sel]}
+    return(index)
+
+
+def read_capture_log(folder):
+    """
+    Read the per-frame metadata index (capture_log.csv) written by
+    timelapse.py in the experiment folder
+
+    Parameters
+    ----------
+    folder : string
+        experiment folder
+
+    Returns
+    -------
+    log: dictionary
+        list of values of each column (frame, file, timestamp, config, etc.)
+
+    """
+    import csv
+    log = {}
+    with open(os.path.join(folder, CAPTURE_LOG)) as f:
+        for row in csv.DictReader(f):
+            for key in row:
+                log.setdefault(key, []).append(row[key])
+    return(log)
+
+
+def config_files(folder, config):
+    """
+    Get the image files of one acquisition configuration (LED and camera
+    settings of a sequenced time-lapse) from the capture log, in capture order
+
+    Parameters
+    ----------
+    folder : string
+        experiment folder
+
+    config : string
+        name of the configuration
+
+    Returns
+    -------
+    files: list
+        full path of the files captured with that configuration
+
+    """
+    log = read_capture_log(folder)
+    return([os.path.join(folder, log['file'][i]) for i in range(len(log['file']))
+            if log['config'][i] == config])
+
+
+def imread_reduced(f_name, scale):
+    """
+    Read an image at reduced resolution. JPEG files are downscaled while
+    decoding (DCT scaling, scale = 2, 4 or 8), which is much faster than a full
+    decode. Other files or scales are reduced averaging blocks of scale x scale
+    pixels. The data type and values range are the same as plt.imread for
+    any scale (PNG files as float 0-1).
+
+    Parameters
+    ----------
+    f_name : string
+        full path of the image file
+
+    scale : int
+        reduction factor of each image side
+
+    Returns
+    -------
+    im: array_like
+        image data of size ~(W/scale, H/scale, channels)
+
+    """
+    scale = int(scale)
+    if scale <= 1:
+        return(plt.imread(f_name))
+
+    im = Image.open(f_name)
+    png = im.format == 'PNG'
+    if png and im.mode in ('P', 'LA'):
+        im = im.convert('RGBA')
+    w,h = im.size
+    if scale in (2,4,8):
+        im.draft(im.mode, (int(np.ceil(w/float(scale))), int(np.ceil(h/float(scale)))))
+    reduced = w/float(im.size[0])
+    im = np.asarray(im)
+    dtype = im.dtype
+
+    # block average path for the remaining reduction factor
+    block = int(round(scale/reduced))
+    if block > 1:
+        n = int(im.shape[0]/block)
+        m = int(im.shape[1]/block)
+        im = im[:n*block,:m*block].reshape((n,block,m,block)+im.shape[2:]).mean(axis=(1,3))
+        if np.issubdtype(dtype, np.integer):
+            im = np.rint(im)
+        im = im.astype(dtype)
+
+    # same values range as plt.imread (used for scale = 1): PNG files as
+    # float 0-1, the other formats as stored
+    if png and dtype != bool:
+        im = np.divide(im, 2**16-1 if dtype.itemsize > 1 else 2**8-1, dtype=np.float32)
+    elif png:
+        im = im.astype(np.float32)
+    return(im)
+
+
+def get_im_data(x_frames,image_count,f_name, init = 0, scale = 1, config = None):
     """
     Load image data from a sequence of files
 
@@ -99,13 +299,23 @@ def get_im_data(x_frames,image_count,f_name, init = 0):
     image_count : int
         total number of files on the folder (can be obtained with count_files function)
 
-    f_name : string
-        file name pattern including full path where images are stored, e.g. "/folder/image-%04d"
+    f_name : string or list
+        file name pattern including full path where images are stored, e.g. "/folder/image-%04d".
+        It can also be a list of file names, or the experiment folder when config is given.
     
     init: int
         first image number name to be used in the analysis. 
         e.g. init = 33 means to use /folder/image-%33
 
+    scale: int
+        reduction factor of the image resolution (see imread_reduced), e.g.
+        scale = 4 to get a quick low resolution stack for colony detection.
+        Use blobs_rescale to map the detected blobs back to full resolution.
+
+    config: string
+        name of the acquisition configuration to load from a sequenced
+        time-lapse (see config_files), f_name being the experiment folder
+
     Returns
     -------
     ImsR,ImsG,ImsB: array_like
@@ -113,7 +323,14 @@ def get_im_data(x_frames,image_count,f_name, init = 0):
 
     """
     
-    W,H,_ = plt.imread(f_name%init).shape      # Measure the image size based on the first image on the folder
+    if config is not None:
+        f_name = config_files(f_name, config)
+    if isinstance(f_name, str):
+        name = lambda n: f_name%n
+    else:
+        name = lambda n: f_name[n]
+
+    W,H,_ = imread_reduced(name(init), scale).shape      # Measure the image size based on the first image on the folder
     NT = int(image_count/x_frames)
     ImsR = np.zeros((W,H,NT))
     ImsG = np.zeros((W,H,NT))
@@ -121,7 +338,7 @@ def get_im_data(x_frames,image_count,f_name, init = 0):
     init = int(init)
     
     for i in range(0,NT):
-        im = plt.imread(f_name%(init + i*x_frames))
+        im = imread_reduced(name(init + i*x_frames), scale)
         ImsR[:,:,i] = im[:,:,0]              # Last number code the channel: 0=red, 1=green, 2=blue
         ImsG[:,:,i] = im[:,:,1]
         ImsB[:,:,i] = im[:,:,2]
@@ -131,7 +348,7 @@ def get_im_data(x_frames,image_count,f_name, init = 0):
 # red,_,blue=get_im_data(xframes,imagecount)  ---> this only takes the red and blue channels
 
 
-def time_vector(data, x_frames, dt):
+def time_vector(data, x_frames, dt, timestamps=None, init=0):
     """
     Get the vector of times for the image sequence loaded
 
@@ -145,6 +362,15 @@ def time_vector(data, x_frames, dt):
     
     dt : double
         time step of the frames in hour units. It can be obtained from the file used to perform the timelapse.
+
+    timestamps : dictionary or array_like
+        acquisition times from timestamp_index(path) (the time of each frame
+        is taken by its frame number, interpolated for the missing frames),
+        or the acquisition time of every frame in seconds, by position. If
+        given, the true times are used instead of the uniform dt.
+
+    init: int
+        first image number used on the analysis (as in get_im_data)
         
     Returns
     -------
@@ -153,11 +379,15 @@ def time_vector(data, x_frames, dt):
     """
 
     _,_,LT = data[CHANNELS[0]].shape     # Length of time vector
-    T = np.zeros((LT))
-    for i in range(0,LT):
-        T[i] = (i)*x_frames*dt
-    
-    return(T)
+    if timestamps is None:
+        return(np.arange(LT)*x_frames*dt)
+
+    frames = int(init) + np.arange(LT)*x_frames
+    if isinstance(timestamps, dict):
+        ts = np.interp(frames, timestamps['Index'], timestamps['Timestamps'])
+    else:
+        ts = np.asarray(timestamps)[frames]
+    return((ts - ts[0])/3600.)
 
 
 def bg_value(x1, x2, y1, y2, data, im_count):
@@ -251,6 +481,129 @@ def bg_subst(data, bg):
 
     return(data)
 
+
+def bg_grid(data, tile=64, percentile=50):
+    """
+    Estimate a spatially varying background for each channel and frame as a
+    robust percentile over square tiles of the image. All frames and channels
+    are computed at once. Use bg_surface to interpolate the tile values to
+    full resolution or bg_surface_subst to substract it from the data.
+
+    Parameters
+    ----------
+    data : dictionary
+        R G B images data (or single frames, with shape (W,H,1))
+
+    tile : int
+        side of the square tiles (pixels). Tiles have to be larger than the
+        colonies for the percentile to fall on background pixels.
+
+    percentile: double
+        percentile of each tile used as background value (50 = median)
+
+    Returns
+    -------
+    grid: dictionary
+        background value of each tile, channel and frame.
+        call it as: grid['channel_name'][tile_x, tile_y, frame]
+
+    """
+    W,H,_ = data[CHANNELS[0]].shape
+    nx = max(int(W/tile), 1)
+    ny = max(int(H/tile), 1)
+    tx = min(tile, W)
+    ty = min(tile, H)
+
+    grid = {}
+    for c in CHANNELS:
+        blocks = data[c][:nx*tx,:ny*ty,:].reshape((nx,tx,ny,ty,-1))
+        grid[c] = np.percentile(blocks, percentile, axis=(1,3))
+    return(grid)
+
+
+def bg_weights(n, n_tiles, tile):
+    """
+    Linear interpolation matrix (n x n_tiles) from the tile centers to each
+    pixel position, constant beyond the first and last tile centers
+    """
+    centers = (np.arange(n_tiles)+0.5)*min(tile, n)-0.5
+    pos = np.arange(n)
+    return(np.array([np.interp(pos, centers, e) for e in np.eye(n_tiles)]).T)
+
+
+def bg_surface(grid, shape, tile=64, frames=None):
+    """
+    Interpolate (bilinear) the tile background values obtained with bg_grid
+    to a full resolution background surface
+
+    Parameters
+    ----------
+    grid: dictionary
+        background value of each tile, channel and frame (from bg_grid)
+
+    shape: tuple
+        (W,H) size of the image frames
+
+    tile : int
+        side of the tiles used on bg_grid
+
+    frames: list
+        frames to interpolate, default = all of them
+
+    Returns
+    -------
+    bg: dictionary
+        background surface of each channel. call it as: bg['channel_name'][x,y,frame]
+
+    """
+    nx,ny,_ = grid[CHANNELS[0]].shape
+    WX = bg_weights(shape[0], nx, tile)
+    WY = bg_weights(shape[1], ny, tile)
+
+    bg = {}
+    for c in CHANNELS:
+        G = grid[c] if frames is None else grid[c][:,:,frames]
+        bg[c] = np.einsum('xi,ijt,yj->xyt', WX, G, WY, optimize=True)
+    return(bg)
+
+
+def bg_surface_subst(data, grid, tile=64, frames_chunk=16):
+    """
+    Substract the background surface estimated with bg_grid for each channel
+    and frame. Negative values are set to zero as in bg_subst. The surface
+    is interpolated by blocks of frames to bound the memory used.
+
+    Parameters
+    ----------
+    data: dictionary
+        R G B images data
+
+    grid: dictionary
+        background value of each tile, channel and frame (from bg_grid)
+
+    tile : int
+        side of the tiles used on bg_grid
+
+    frames_chunk: int
+        number of frames interpolated at once
+
+    Returns
+    -------
+    Data: dictionary
+        R G B images data with the background substracted
+
+    """
+    W,H,NT = data[CHANNELS[0]].shape
+    for i in range(0, NT, frames_chunk):
+        frames = list(range(i, min(i+frames_chunk, NT)))
+        bg = bg_surface(grid, (W,H), tile, frames)
+        for c in CHANNELS:
+            Data = data[c][:,:,i:i+len(frames)] - bg[c]
+            Data[Data<0] = 0        # values < 0 are not allowed --> transform it to 0
+            data[c][:,:,i:i+len(frames)] = Data
+
+    return(data)
+
 def data_sum_time(data):
     """
     Sum the data for each pixel over time
@@ -402,6 +755,30 @@ def colony_blobs_id(data, im_name, thresh, sigma_lims =[1,10], max_over=0.8, fil
     return(A)
 
 
+def blobs_rescale(blobs, scale):
+    """
+    Map the blobs detected on reduced resolution data (get_im_data with
+    scale > 1) to full resolution coordinates, to be used for ROI extraction
+
+    Parameters
+    ----------
+    blobs: array like
+        Array of colony positions and sizes given by colony_blobs_id()
+
+    scale: int
+        reduction factor used to load the data
+
+    Returns
+    -------
+    A: array (Nx3)
+        (x,y) position and size of each blob at full resolution
+    """
+    A = np.array(blobs, dtype=float)
+    A[:,0:2] = (A[:,0:2]+0.5)*scale-0.5     # pixel centers of the reduced image
+    A[:,2] = A[:,2]*scale
+    return(A)
+
+
 def obtain_rois(data,blobs):
     """
     Based on the information of each identified colony, create arrays to contain
@@ -483,6 +860,143 @@ def obtain_rois(data,blobs):
 # rois_circle makes the values outside the colony boundaries equals to zero
 
 
+def roi_limits(blobs, shape):
+    """
+    Compute the limits of the square region around each colony, with the same
+    criteria used by obtain_rois (side 2*(colony size), cut at image borders)
+
+    Parameters
+    ----------
+    blobs: array like
+        Array of colony positions and sizes given by colony_blobs_id()
+
+    shape: tuple
+        (W,H) size of the image frames
+
+    Returns
+    -------
+    lims: list
+        (x1,x2,y1,y2) slice limits of each ROI. None if the ROI is empty
+    """
+    lims = []
+    for i in range(len(blobs)):
+        x = blobs[i,0]
+        y = blobs[i,1]
+        r = 2*blobs[i,2]
+
+        x1 = max(int(round(x-r)), 0)
+        x2 = int(round(x+r+1))      #plus 1 because slice working
+        y1 = max(int(round(y-r)), 0)
+        y2 = int(round(y+r+1))
+        if x2 >= shape[0]:
+            x2 = shape[0]-1
+        if y2 >= shape[1]:
+            y2 = shape[1]-1
+
+        if x2>x1 and y2>y1:
+            lims.append((x1,x2,y1,y2))
+        else:
+            lims.append(None)
+    return(lims)
+
+
+def circle_mask(shape, r):
+    """
+    Boolean mask of the pixels inside the circle of radius r centered on a
+    ROI, as used by obtain_rois to build the circular ROIs
+
+    Parameters
+    ----------
+    shape: tuple
+        (n,m) size of the ROI
+
+    r: double
+        circle radius (pixels)
+
+    Returns
+    -------
+    mask: array like
+        True for the pixels inside the circle
+    """
+    xr = int((shape[0]+1)/2)
+    yr = int((shape[1]+1)/2)
+    n,m = np.ogrid[0:shape[0], 0:shape[1]]
+    return(((n-xr)**2+(m-yr)**2) <= (r**2))
+
+
+def get_rois_data(blobs, x_frames, image_count, f_name, init=0):
+    """
+    Load only the regions of interest (ROI) around each colony from a sequence
+    of files. Each frame is decoded once but only the crop windows are kept in
+    memory, so the memory used scales with the colonies area instead of the
+    whole image. The output is equivalent to get_im_data followed by
+    obtain_rois.
+
+    Parameters
+    ----------
+    blobs: array like
+        Array of colony positions and sizes given by colony_blobs_id()
+
+    x_frames : int
+        step frames (e.g 10 to use only ten to ten images)
+
+    image_count : int
+        total number of files on the folder (can be obtained with count_files function)
+
+    f_name : string
+        file name pattern including full path where images are stored, e.g. "/folder/image-%04d"
+
+    init: int
+        first image number name to be used in the analysis.
+
+    Returns
+    -------
+    all_rois:
+        The ROI array image data, to call it: all_rois['channel_name'][blob_number][y,x,timepoint]
+
+    all_rois_circle:
+        The ROI array image data only within the colony circle (see obtain_rois)
+
+    nc:
+        Number of colonies analysed (length of returned arrays)
+    """
+    init = int(init)
+    W,H,_ = plt.imread(f_name%init).shape
+    NT = int(image_count/x_frames)
+    nc = len(blobs)
+    lims = roi_limits(blobs, (W,H))
+
+    all_rois = {}
+    for c in CHANNELS:
+        all_rois[c] = {}
+        for i in range(nc):
+            if lims[i] is None:
+                all_rois[c][i] = []
+            else:
+                x1,x2,y1,y2 = lims[i]
+                all_rois[c][i] = np.zeros((x2-x1,y2-y1,NT))
+
+    for t in range(0,NT):
+        im = plt.imread(f_name%(init + t*x_frames))
+        for i in range(nc):
+            if lims[i] is not None:
+                x1,x2,y1,y2 = lims[i]
+                for k in range(len(CHANNELS)):
+                    all_rois[CHANNELS[k]][i][:,:,t] = im[x1:x2,y1:y2,k]
+
+    all_rois_circle = {}
+    for c in CHANNELS:
+        all_rois_circle[c] = {}
+        for i in range(nc):
+            if lims[i] is None:
+                all_rois_circle[c][i] = []
+            else:
+                mask = circle_mask(all_rois[c][i].shape, 2*blobs[i,2])
+                all_rois_circle[c][i] = all_rois[c][i]*mask[:,:,np.newaxis]
+
+    return(all_rois,all_rois_circle,nc)
+
+
 def channels_sum(rois_data, cv):
     """
     Compute the sum over the RGB channels for each image
@@ -511,6 +1025,167 @@ def channels_sum(rois_data, cv):
     return(sum_chan_rois)
 
 
+def rois_time_sum(rois_data, cv):
+    """
+    Sum the pixel values of each ROI for each channel and time step, for
+    all the colonies at once
+
+    Parameters
+    ----------
+    rois_data: dictionary
+            RGB time-lapse image data of each ROIS, from obtain_rois()
+
+    cv: vector
+            contain the ID of the of colonies analysed
+
+    Returns
+    -------
+        traces: dictionary
+            (colony x time) array for each channel, rows in the order of cv.
+            Call it as traces['channel_name'][position on cv, timepoint]
+    """
+    nt = max(rois_data[CHANNELS[0]][i].shape[2] for i in cv if len(rois_data[CHANNELS[0]][i]))
+    traces = {}
+    for c in CHANNELS:
+        traces[c] = np.zeros((len(cv), nt))
+        for k in range(len(cv)):
+            if len(rois_data[c][cv[k]]):
+                traces[c][k] = rois_data[c][cv[k]].sum(axis=(0,1))
+    return(traces)
+
+
+def roi_transects(rois, cv='null', name='null', folder='null'):
+    """
+    Extract the center row and center column transects of every ROI over
+    time (the kymographs used by check_radius) into dense arrays, so they
+    can be browsed without slicing the ROIs again. Transects shorter than
+    the longest one are padded with NaN.
+
+    Parameters
+    ----------
+    rois: dictionary
+        ROI image of each colony (e.g. from channels_sum) or RGB ROI data
+        from obtain_rois (the channels are summed)
+
+    cv: vector
+        ID of the colonies, default = all the non empty ROIs
+
+    name, folder: string
+        if given, the transects are saved as name.pkl on folder (see
+        save_obj) and loaded from there on next calls
+
+    Returns
+    -------
+    kymo: dictionary
+        'Ids' (colony IDs), 'Rows' and 'Cols' (colony x position x time
+        arrays with the center row and center column of each ROI) and
+        'Length' (number of valid positions of each row and column)
+    """
+    if name != 'null' and os.path.exists(os.path.join(folder, str(name) + '.pkl')):
+        return(load_obj(name, folder))
+
+    if CHANNELS[0] in rois:
+        if cv == 'null':
+            cv = [i for i in sorted(rois[CHANNELS[0]]) if len(rois[CHANNELS[0]][i])]
+        rois = channels_sum(rois, cv)
+    elif cv == 'null':
+        cv = [i for i in sorted(rois) if len(rois[i])]
+
+    shapes = np.array([rois[i].shape for i in cv])
+    N = len(cv)
+    nt = shapes[:,2].max()
+    rows = np.full((N, shapes[:,1].max(), nt), np.nan)
+    cols = np.full((N, shapes[:,0].max(), nt), np.nan)
+    for k in range(N):
+        w,h,t = shapes[k]
+        rows[k,:h,:t] = rois[cv[k]][int(round((w-1)/2)),:,:]
+        cols[k,:w,:t] = rois[cv[k]][:,int(round((h-1)/2)),:]
+
+    kymo = {'Ids': list(cv), 'Rows': rows, 'Cols': cols,
+            'Length': np.stack([shapes[:,1], shapes[:,0]], axis=1)}
+    if name != 'null':
+        save_obj(kymo, name, folder)
+    return(kymo)
+
+
+def rois_features(rois_data, frames=[-1], cv='null', blobs='null', name='null', folder='null'):
+    """
+    Sum and mean pixel value inside the colony of every ROI, for each
+    channel and each requested frame, as dense arrays. The ROIs with the
+    same size are stacked and reduced together, so the ROI data is read
+    only once for all the features. The features can be given to
+    rois_last_frame_2chan_plt and colony_classifier, e.g. the green
+    channel of the last frame is feats['Sum'][:, CHANNELS.index('G'), -1]
+
+    Parameters
+    ----------
+    rois_data: dictionary
+        RGB time-lapse image data of each ROI, from obtain_rois()
+
+    frames: list
+        time steps to compute (negative values count from the end),
+        'null' for all of them
+
+    cv: vector
+        ID of the colonies, default = all the ROIs (empty ones included)
+
+    blobs: array like
+        colonies from colony_blobs_id, to use the circle of radius
+        2*blobs[i,2] of obtain_rois for the mean; default = circle inscribed
+        on the ROI
+
+    name, folder: string
+        if given, the features are saved as name.pkl on folder (see
+        save_obj) and loaded from there on next calls
+
+    Returns
+    -------
+    feats: dictionary
+        'Ids' (colony IDs), 'Frames' (time steps), 'Sum' (colony x channel x
+        frame array, sum of all the ROI pixels), 'Mean' (same size, mean of
+        the pixels inside the circle, NaN for empty ROIs) and 'Pixels'
+        (number of pixels inside the circle of each colony). Channels are
+        in the order of CHANNELS.
+    """
+    if name != 'null' and os.path.exists(os.path.join(folder, str(name) + '.pkl')):
+        return(load_obj(name, folder))
+
+    if isinstance(cv, str):
+        cv = sorted(rois_data[CHANNELS[0]])
+    shapes = [np.shape(rois_data[CHANNELS[0]][i]) for i in cv]
+    nt = max([s[2] for s in shapes if len(s) == 3] + [0])
+    frames = np.arange(nt) if isinstance(frames, str) else np.arange(nt)[np.asarray(frames)]
+
+    N = len(cv)
+    feats = {'Ids': list(cv), 'Frames': frames,
+             'Sum': np.zeros((N, len(CHANNELS), len(frames))),
+             'Mean': np.full((N, len(CHANNELS), len(frames)), np.nan),
+             'Pixels': np.zeros(N, dtype=int)}
+
+    # positions on cv of the ROIs of each size
+    groups = {}
+    for k in range(N):
+        if len(shapes[k]) == 3:
+            groups.setdefault(shapes[k][:2], []).append(k)
+
+    for shape, pos in groups.items():
+        masks = np.empty((len(pos),) + shape, dtype=bool)
+        for j in range(len(pos)):
+            r = 2*blobs[cv[pos[j]],2] if not isinstance(blobs, str) else (min(shape)-1)/2.
+            masks[j] = circle_mask(shape, r)
+        npix = masks.sum(axis=(1,2))
+        for n in range(len(CHANNELS)):
+            stack = np.stack([rois_data[CHANNELS[n]][cv[k]][:,:,frames] for k in pos])
+            feats['Sum'][pos,n,:] = stack.sum(axis=(1,2))
+            inside = (stack * masks[:,:,:,None]).sum(axis=(1,2))
+            feats['Mean'][pos,n,:] = inside / np.maximum(npix, 1)[:,None]
+        feats['Pixels'][pos] = npix
+
+    if name != 'null':
+        save_obj(feats, name, folder)
+    return(feats)
+
+
 def frame_colony_radius(rois, cv, thr, min_sig=0.5, max_sig=10, num_sig=200):
     """
     Get the colony radius at each time step
@@ -547,19 +1222,44 @@ def frame_colony_radius(rois, cv, thr, min_sig=0.5, max_sig=10, num_sig=200):
     for k in cv:
         R[k] = np.zeros((nt,))
         for i in range(nt):
-            troi = rois[k][:,:,i].astype(np.float32)
+            troi = rois[k][:,:,i]
             if len(troi):
-                nt_roi = (troi-troi.min())/(troi.max()-troi.min())  # Normalization
-                AA = skfeat.blob_log(nt_roi, min_sigma=min_sig, 
-                                     max_sigma=max_sig, num_sigma=num_sig, 
-                                     threshold=thr, overlap=0.8)
-                #AA = skfeat.blob_log(nt_roi, min_sigma=0.1, max_sigma=6.0, num_sigma=150, threshold=thr, overlap=0.8)
-                if len(AA)>0:
-                    R[k][i] = AA[0,2]*(2)
-                    #R[k][i] = AA[0,2]*(2**0.5)
+                R[k][i] = roi_radius(troi, thr, min_sig, max_sig, num_sig)
     return(R)
 
 
+def roi_radius(troi, thr, min_sig=0.5, max_sig=10, num_sig=200):
+    """
+    Get the colony radius on a single ROI frame (used by frame_colony_radius)
+
+    Parameters
+    ----------
+        troi: array like
+            ROI image data of one frame
+
+        thr: double
+            Threshold for skfeat.blob_log
+
+        min_sig, max_sig, num_sig:
+            sigma values used on skfeat.blob_log (see frame_colony_radius)
+
+    Returns
+    -------
+        r: double
+            colony radius, 0 if no blob was found
+    """
+    troi = troi.astype(np.float32)
+    nt_roi = (troi-troi.min())/(troi.max()-troi.min())  # Normalization
+    AA = skfeat.blob_log(nt_roi, min_sigma=min_sig,
+                         max_sigma=max_sig, num_sigma=num_sig,
+                         threshold=thr, overlap=0.8)
+    #AA = skfeat.blob_log(nt_roi, min_sigma=0.1, max_sigma=6.0, num_sigma=150, threshold=thr, overlap=0.8)
+    if len(AA)>0:
+        return(AA[0,2]*(2))
+        #return(AA[0,2]*(2**0.5))
+    return(0)
+
+
 def area(r, cv, T, filename='null'):
     """
     Compute and plot the colonies area over time as a perfect circle (using 
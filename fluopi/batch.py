@@ -0,0 +1,154 @@
+"""
+Batch analysis of many FluoPi plates (one experiment folder per plate),
+running the steps of Examples/Colony_size_and_fluo.ipynb on each plate:
+load -> background -> detection -> ROI -> radius -> fluorescence -> fit
+
+to run: fluopi-batch folder1 folder2 ... [--params params.json] [--processes n] [--report]
+(or python -m fluopi.batch ...)
+
+The results of each stage are cached on the plate folder (see
+fluopi.pipeline), so an interrupted batch resumes from the last completed
+stage of each plate, and a parameter change only recomputes the stages
+which depend on it.
+"""
+import csv
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import matplotlib.pyplot as plt
+
+from fluopi.pipeline import Pipeline, load_pipeline
+from fluopi.report import plate_report
+from fluopi.plotting import RenderContext
+
+# Columns of the batch summary table
+SUMMARY_FIELDS = ['folder', 'status', 'frames', 'filled', 'colonies', 'fitted',
+                  'mean_final_radius', 'mean_max_area', 'mean_rate', 'secs']
+
+
+def process_plate(folder, params=None, report=False):
+    """
+    Run the analysis pipeline on one plate (see fluopi.pipeline), reusing
+    the stages already cached on the plate folder (params['out_folder']).
+    Figures are saved on that folder instead of being shown.
+
+    Parameters
+    ----------
+    folder : string
+        experiment folder with the time-lapse images of the plate
+
+    params : dictionary
+        analysis parameters (see fluopi.pipeline.load_pipeline)
+
+    report : boolean
+        True to also write the plate report on the output folder (see
+        fluopi.report.plate_report)
+
+    Returns
+    -------
+    row: dictionary
+        summary of the plate results (SUMMARY_FIELDS)
+    """
+    t1 = time.time()
+    pipe = Pipeline(folder, params)
+    with RenderContext(profile=False):     # close the figures of the stages
+        T = pipe.get('load.T')
+        cols = pipe.get('rois.Cols')
+        R = pipe.get('radius.Radius')
+        pipe.get('fluorescence.MeanInt')
+        fit = pipe.get('fit.Fit')
+    if report:
+        plate_report(folder, params, processes=1)     # already on a worker
+
+    z = np.array([fit[i][1] for i in fit])
+    row = {'folder': folder, 'status': 'ok', 'frames': len(T),
+           'filled': int(np.sum(pipe.get('load.Filled'))), 'colonies': len(cols),
+           'fitted': len(z),
+           'mean_final_radius': np.mean([R[i][-1] for i in cols]) if len(cols) else '',
+           'mean_max_area': z[:,0].mean() if len(z) else '',
+           'mean_rate': z[:,2].mean() if len(z) else '',
+           'secs': round(time.time()-t1, 1)}
+    return(row)
+
+
+def _run_plate(args):
+    folder, params, report = args
+    try:
+        return(process_plate(folder, params, report))
+    except Exception as e:
+        plt.close('all')
+        return({'folder': folder, 'status': 'error: ' + repr(e)})
+
+
+def _init_worker():
+    plt.switch_backend('Agg')   # figures are only saved
+
+
+def run_batch(folders, params=None, processes=None, summary='batch_summary.csv',
+              report=False):
+    """
+    Analyse many plates in parallel (one process per plate, see
+    process_plate). A plate failing does not stop the batch, its error is
+    reported on the summary table.
+
+    Parameters
+    ----------
+    folders : list
+        experiment folders, one per plate
+
+    params : dictionary
+        analysis parameters (see fluopi.pipeline.load_pipeline)
+
+    processes : int
+        number of worker processes (default = number of CPUs)
+
+    summary : string
+        CSV file where the summary table is written, 'null' to not write it
+
+    report : boolean
+        True to write the report of each plate (see fluopi.report.plate_report)
+
+    Returns
+    -------
+    rows: list
+        summary of each plate (SUMMARY_FIELDS), in the order of folders
+    """
+    jobs = [(folder, params, report) for folder in folders]
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    try:
+        rows = []
+        for row in pool.imap(_run_plate, jobs):
+            print(row['folder'] + ': ' + row['status'])
+            rows.append(row)
+    finally:
+        pool.close()
+        pool.join()
+
+    if summary != 'null':
+        with open(summary, 'w') as f:
+            writer = csv.DictWriter(f, SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    return(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch analysis of FluoPi plates')
+    parser.add_argument('folders', nargs='+', help='experiment folders, one per plate')
+    parser.add_argument('--params', default=None,
+                        help='JSON file with the analysis parameters and stages')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='number of worker processes (default = number of CPUs)')
+    parser.add_argument('--summary', default='batch_summary.csv',
+                        help='CSV file of the summary table')
+    parser.add_argument('--report', action='store_true',
+                        help='write the HTML/PDF report of each plate')
+    args = parser.parse_args()
+
+    run_batch(args.folders, load_pipeline(args.params), args.processes, args.summary,
+              args.report)
+
+
+if __name__ == '__main__':
+    main()
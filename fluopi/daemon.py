@@ -0,0 +1,388 @@
+"""
+Online analysis of a time-lapse while it is being captured by
+Hardware_control/timelapse.py
+
+to run: python -m fluopi.daemon folder [--period secs] [--thresh thr]
+"""
+import os
+import glob
+import time
+import argparse
+import threading
+import collections
+import numpy as np
+import matplotlib.pyplot as plt
+import skimage.feature as skfeat
+from skimage.filters import gaussian
+
+from fluopi.analysis import (CHANNELS, file_timestamp, roi_limits, circle_mask,
+                             roi_radius, save_obj)
+from fluopi.streaming import FrameAccumulator, BackgroundEstimator
+from fluopi.manifest import is_complete, build_manifest
+
+
+class AnalysisDaemon(object):
+    """
+    Process the frames of a capture folder as they are written, updating
+    the background estimate, the summary images of the background substracted
+    frames and, once the colonies are defined (set_colonies or
+    detect_colonies), the fluorescence intensity and radius series of each
+    colony.
+
+    Call poll() to process the new files once, or start() to keep polling the
+    folder on a background thread, or consume() to process in-memory frames.
+    The colonies are detected automatically after detect_after frames. The
+    last buffer frames are kept in memory, so the series of the frames
+    already processed can be computed when the colonies are (re)defined
+    without depending on image files which the in-memory capture modes may
+    write late or never; older frames are read from their files. Current results are given by results(),
+    and saved to the folder as a .pkl object after each update when out_name
+    is given (load it with load_obj).
+
+    Parameters
+    ----------
+    folder : string
+        folder where the images are being written
+
+    file_type : string
+        extension of the image files
+
+    tile, percentile:
+        background estimation parameters (see bg_grid)
+
+    thr, min_sig, max_sig, num_sig:
+        colony radius estimation parameters (see frame_colony_radius)
+
+    out_name : string
+        name of the results object saved on the folder, 'null' to not save it
+
+    timeout : double
+        seconds to wait for an incomplete file before skipping it (it is
+        skipped at once when the next file is already complete)
+
+    detect_after : int
+        number of frames summed before detecting the colonies with
+        detect_colonies(thresh), 'null' to define them by hand
+
+    thresh : double
+        colony detection threshold (see colony_blobs_id)
+
+    buffer : int
+        number of recent frames kept in memory
+    """
+
+    def __init__(self, folder, file_type='jpg', tile=64, percentile=50, thr=0.25,
+                 min_sig=0.5, max_sig=10, num_sig=200, out_name='online_results',
+                 timeout=60, detect_after=10, thresh=0.26, buffer=20):
+        self.folder = folder
+        self.file_type = file_type
+        self.radius_params = (thr, min_sig, max_sig, num_sig)
+        self.out_name = out_name
+        self.timeout = timeout
+        self.detect_after = detect_after
+        self.thresh = thresh
+        self.buffer = buffer
+
+        self.acc = FrameAccumulator()
+        self.bg = BackgroundEstimator(tile, percentile)
+        self.files = []
+        self.times = []
+        self.corrupt = []
+        self._pending = {}
+        self._manifest = {}
+        self._recent = collections.OrderedDict()    # last frames, fname: image data
+        self.blobs = None
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def new_files(self):
+        """
+        Incomplete files are waited for, keeping the frames order, until the
+        next file is complete or timeout seconds have passed; then they are
+        skipped and listed on self.corrupt
+
+        Returns
+        -------
+        list of the complete image files of the folder not processed yet
+        """
+        done = set(self.files) | set(self.corrupt)
+        names = sorted(glob.glob(os.path.join(self.folder, '*.' + self.file_type)))
+        new = []
+        for k in range(len(names)):
+            fname = names[k]
+            if fname in done:
+                continue
+            if is_complete(fname):
+                self._pending.pop(fname, None)
+                new.append(fname)
+                continue
+            first = self._pending.setdefault(fname, time.time())
+            if ((k+1 < len(names) and is_complete(names[k+1])) or
+                    time.time() - first > self.timeout):
+                print('skipping incomplete file ' + fname)
+                self._pending.pop(fname)
+                self.corrupt.append(fname)
+                continue
+            break                   # keep the frames order, wait for this one
+        return(new)
+
+    def poll(self):
+        """
+        Process the new files of the folder
+
+        Returns
+        -------
+        n: int
+            number of new frames processed
+        """
+        new = self.new_files()
+        for fname in new:
+            self.process_frame(fname)
+        if len(new) and self.out_name != 'null':
+            save_obj(self.results(), self.out_name, self.folder)
+        return(len(new))
+
+    def timestamp(self, fname):
+        """
+        Capture time of a frame file (seconds), from the folder manifest
+        """
+        name = os.path.basename(fname)
+        if name not in self._manifest.get('Entries', {}):
+            self._manifest = build_manifest(self.folder, self.file_type)
+        entry = self._manifest['Entries'].get(name)
+        return(entry[3] if entry is not None else file_timestamp(fname))
+
+    def process_frame(self, fname, im=None, ts=None):
+        """
+        Update all the results with a new frame
+
+        Parameters
+        ----------
+        fname : string
+            file name of the frame
+
+        im: array_like
+            image data of the frame, read from fname if not given
+
+        ts: double
+            capture time of the frame (seconds), if not given it is taken
+            as on the batch analysis: from the capture log (see
+            build_manifest), or from fname when the frame is not logged
+        """
+        if im is None:
+            im = plt.imread(fname)
+        if ts is None:
+            ts = self.timestamp(fname)
+        with self._lock:
+            frame = self.bg.update(im)
+            self.acc.update(np.dstack([frame[c] for c in CHANNELS]))
+            self.files.append(fname)
+            self.times.append(ts)
+            if self.blobs is not None:
+                self._update_colonies(frame)
+            self._recent[fname] = im
+            while len(self._recent) > self.buffer:
+                self._recent.popitem(last=False)
+        if (self.blobs is None and self.detect_after != 'null' and
+                len(self.files) >= self.detect_after):
+            A = self.detect_colonies(self.thresh)
+            print(str(len(A)) + ' colonies detected')
+
+    def consume(self, frames):
+        """
+        Process the in-memory frames put in a queue by capture_cycle, until
+        None is received
+
+        Parameters
+        ----------
+        frames : Queue
+            queue of (fname, timestamp, image data) items
+        """
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            fname, ts, im = item
+            self.process_frame(fname, im, ts)
+            if self.out_name != 'null':
+                save_obj(self.results(), self.out_name, self.folder)
+
+    def _update_colonies(self, frame):
+        thr, min_sig, max_sig, num_sig = self.radius_params
+        for i in range(len(self.blobs)):
+            if frame is None:       # frame data not available
+                for c in CHANNELS:
+                    self._intensity[c][i].append(np.nan)
+                self._radius[i].append(np.nan)
+                continue
+            if self._lims[i] is None:
+                for c in CHANNELS:
+                    self._intensity[c][i].append(0)
+                self._radius[i].append(0)
+                continue
+            x1,x2,y1,y2 = self._lims[i]
+            chan_sum = 0
+            for c in CHANNELS:
+                roi = frame[c][x1:x2,y1:y2]
+                self._intensity[c][i].append(roi[self._masks[i]].sum())
+                chan_sum = chan_sum + roi
+            self._radius[i].append(roi_radius(chan_sum, thr, min_sig, max_sig, num_sig))
+
+    def set_colonies(self, blobs):
+        """
+        Define the colonies to follow, replacing the previous ones. The
+        series of the frames already processed are computed from the frames
+        kept in memory or their files, with the background of each frame
+        (NaN for the frames without data, e.g. not saved by the in-memory
+        capture), so the series always have one value per processed frame.
+
+        Parameters
+        ----------
+        blobs: array like
+            Array of colony positions and sizes given by colony_blobs_id()
+        """
+        with self._lock:
+            self.blobs = np.array(blobs)
+            shape = self.acc.sum_image().shape
+            self._lims = roi_limits(self.blobs, shape)
+            self._masks = {}
+            for i in range(len(self.blobs)):
+                if self._lims[i] is not None:
+                    x1,x2,y1,y2 = self._lims[i]
+                    self._masks[i] = circle_mask((x2-x1,y2-y1), 2*self.blobs[i,2])
+            self._intensity = dict((c, dict((i, []) for i in range(len(self.blobs))))
+                                   for c in CHANNELS)
+            self._radius = dict((i, []) for i in range(len(self.blobs)))
+
+            for n in range(len(self.files)):
+                im = self._recent.get(self.files[n])
+                if im is None and os.path.exists(self.files[n]):
+                    im = plt.imread(self.files[n])
+                if im is None:
+                    self._update_colonies(None)
+                    continue
+                bg = self.bg.surface(n)
+                frame = {}
+                for k in range(len(CHANNELS)):
+                    frame[CHANNELS[k]] = im[:,:,k] - bg[CHANNELS[k]]
+                    frame[CHANNELS[k]][frame[CHANNELS[k]]<0] = 0
+                self._update_colonies(frame)
+
+    def detect_colonies(self, thresh, sigma_lims=[1,10], max_over=0.8, sigma=0.7):
+        """
+        Detect the colonies on the current summary image (see colony_blobs_id)
+        and follow them with set_colonies
+
+        Parameters
+        ----------
+        thresh: double
+            threshold of skfeat.blob_log, range (0,1)
+
+        sigma_lims: list [min,max]
+            minimum and maximum sigma to search for colonies
+
+        max_over: double
+            maximum overlap allowed between two colonies
+
+        sigma: double
+            gaussian filter applied to the summary image before the detection
+
+        Returns
+        -------
+        A: array (Nx3)
+            (x,y) position and size of each colony detected
+        """
+        # sum of the normalized smoothed channels, as on smooth_data
+        NSIms_All = 0
+        with self._lock:
+            for c in CHANNELS:
+                SIms = gaussian(self.acc.sum()[c], sigma)
+                NSIms_All = NSIms_All + (SIms-SIms.min())/(SIms.max()-SIms.min())
+        A = skfeat.blob_log(NSIms_All, min_sigma=sigma_lims[0], max_sigma=sigma_lims[1],
+                            num_sigma=100, threshold=thresh, overlap=max_over)
+        self.set_colonies(A)
+        return(A)
+
+    def results(self):
+        """
+        Returns
+        -------
+        res: dictionary
+            current results: 'Files', 'Corrupt' (incomplete files skipped),
+            'Times' (hours from the first frame),
+            'Summary' (sum over time and channels of the background
+            substracted data), 'Background' (tile values
+            of each frame, see bg_grid) and, when colonies are defined,
+            'Blobs', 'Intensity' (res['Intensity']['channel_name'][colony][time])
+            and 'Radius' (res['Radius'][colony][time])
+        """
+        with self._lock:
+            res = {}
+            res['Files'] = list(self.files)
+            res['Corrupt'] = list(self.corrupt)
+            T = np.array(self.times)
+            res['Times'] = (T - T[0])/3600. if len(T) else T
+            if self.acc.count:
+                res['Summary'] = self.acc.sum_image().copy()
+                res['Background'] = self.bg.grid()
+            if self.blobs is not None:
+                res['Blobs'] = self.blobs
+                res['Intensity'] = dict((c, dict((i, np.array(v))
+                                                 for i,v in self._intensity[c].items()))
+                                        for c in CHANNELS)
+                res['Radius'] = dict((i, np.array(v)) for i,v in self._radius.items())
+        return(res)
+
+    def start(self, period=5):
+        """
+        Keep polling the folder every period seconds on a background thread
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(period,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self, period=5):
+        """
+        Poll the folder every period seconds until stop() is called
+        """
+        while not self._stop.is_set():
+            n = self.poll()
+            if n:
+                print(str(len(self.files)) + ' frames processed')
+            self._stop.wait(period)
+
+    def stop(self):
+        """
+        Stop the background polling
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Online analysis of a FluoPi capture folder')
+    parser.add_argument('folder', help='folder where timelapse.py writes the images')
+    parser.add_argument('--period', type=float, default=5, help='polling period (secs)')
+    parser.add_argument('--thresh', type=float, default=0.26,
+                        help='colony detection threshold (see colony_blobs_id)')
+    parser.add_argument('--detect-after', type=int, default=10,
+                        help='number of frames summed before detecting the colonies')
+    args = parser.parse_args()
+
+    daemon = AnalysisDaemon(args.folder, detect_after=args.detect_after, thresh=args.thresh)
+    try:
+        while True:
+            if daemon.poll():
+                print(str(len(daemon.files)) + ' frames processed')
+            time.sleep(args.period)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
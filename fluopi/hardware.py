@@ -0,0 +1,340 @@
+"""
+Hardware backends for the FluoPi acquisition scripts.
+
+The 'pi' backend uses picamera and RPi.GPIO on the Raspberry Pi. The 'sim'
+backend uses a synthetic camera producing growing colonies and a fake GPIO,
+so the acquisition and analysis pipeline can be run and tested anywhere.
+The backend is chosen with the FLUOPI_BACKEND environment variable
+(default 'pi').
+"""
+import os
+import io
+import time
+import numpy as np
+from PIL import Image
+
+BACKENDS = ['pi', 'sim']
+
+
+def backend_name(backend=None):
+    """
+    Name of the backend to use: backend if given, otherwise the value of the
+    FLUOPI_BACKEND environment variable ('pi' by default)
+    """
+    if backend is None:
+        backend = os.environ.get('FLUOPI_BACKEND', 'pi')
+    if backend not in BACKENDS:
+        raise ValueError('unknown backend ' + str(backend) + ', use one of ' + str(BACKENDS))
+    return(backend)
+
+
+def get_gpio(backend=None):
+    """
+    Get the GPIO interface of the backend
+
+    Parameters
+    ----------
+    backend : string
+        'pi' or 'sim', default given by FLUOPI_BACKEND
+
+    Returns
+    -------
+    GPIO: RPi.GPIO module or FakeGPIO object
+    """
+    if backend_name(backend) == 'pi':
+        import RPi.GPIO as GPIO
+        return(GPIO)
+    return(FakeGPIO())
+
+
+def get_camera(backend=None, gpio=None, **sim_options):
+    """
+    Get the camera of the backend
+
+    Parameters
+    ----------
+    backend : string
+        'pi' or 'sim', default given by FLUOPI_BACKEND
+
+    gpio : FakeGPIO
+        GPIO controlling the LEDs, used by the simulated camera to produce
+        dark frames when the LEDs are off
+
+    sim_options:
+        options of SimulatedCamera
+
+    Returns
+    -------
+    camera: PiCamera or SimulatedCamera object
+    """
+    if backend_name(backend) == 'pi':
+        from picamera import PiCamera
+        return(PiCamera())
+    return(SimulatedCamera(gpio=gpio, **sim_options))
+
+
+class FakeGPIO(object):
+    """
+    Replacement of the RPi.GPIO module keeping the state of each pin and the
+    history of the outputs as (time, pin, value)
+    """
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self):
+        self.mode = None
+        self.pins = {}
+        self.history = []
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, initial=LOW):
+        self.pins[int(pin)] = initial
+
+    def output(self, pin, value):
+        if int(pin) not in self.pins:
+            raise RuntimeError('The GPIO channel has not been set up as an OUTPUT')
+        self.pins[int(pin)] = value
+        self.history.append((time.time(), int(pin), value))
+
+    def input(self, pin):
+        return(self.pins.get(int(pin), self.LOW))
+
+    def cleanup(self):
+        self.pins = {}
+
+
+class SimulatedCamera(object):
+    """
+    Camera producing synthetic time-lapse frames of a plate with growing
+    fluorescent colonies. Colony radii follow a sigmoid (as f_sigma) over the
+    experiment time, which advances dt hours on each capture. It has the
+    attributes of PiCamera used by the FluoPi scripts and its capture method
+    accepts file names, file-like objects and numpy arrays.
+
+    Parameters
+    ----------
+    gpio : FakeGPIO
+        GPIO of the LEDs, frames are dark when the LED pin is off (None to
+        ignore the LEDs state)
+
+    led_pin : int
+        GPIO pin of the LEDs (None = any pin)
+
+    n_colonies : int
+        number of colonies on the plate
+
+    dt : double
+        experiment time between captures (hours)
+
+    seed : int
+        random seed of the colonies layout
+
+    capture_time : double
+        time spent on each capture (secs), to emulate the exposure
+    """
+
+    def __init__(self, gpio=None, led_pin=None, n_colonies=50, dt=0.25, seed=0,
+                 capture_time=0):
+        self.gpio = gpio
+        self.led_pin = led_pin
+        self.n_colonies = n_colonies
+        self.dt = dt
+        self.seed = seed
+        self.capture_time = capture_time
+        self.frame_count = 0
+
+        # PiCamera settings
+        self.resolution = (960, 720)
+        self.ISO = 400
+        self.framerate = 1
+        self.shutter_speed = 200000
+        self.exposure_speed = 200000
+        self.exposure_mode = 'auto'
+        self.awb_gains = [1, 1]
+        self.awb_mode = 'auto'
+        self.closed = False
+        self._colonies = None
+
+    def _layout(self):
+        w,h = self.resolution
+        if self._colonies is None or self._colonies['shape'] != (h,w):
+            rs = np.random.RandomState(self.seed)
+            n = self.n_colonies
+            colonies = {'shape': (h,w)}
+            # colonies inside the plate (circle of 0.45*min(w,h) radius)
+            ang = rs.uniform(0, 2*np.pi, n)
+            rad = 0.42*min(w,h)*np.sqrt(rs.uniform(0, 1, n))
+            colonies['x'] = h/2. + rad*np.sin(ang)
+            colonies['y'] = w/2. + rad*np.cos(ang)
+            colonies['r_max'] = rs.uniform(0.008, 0.02, n)*min(w,h)
+            colonies['delay'] = -rs.uniform(5, 15, n)
+            colonies['rate'] = rs.uniform(0.2, 0.4, n)
+            colors = np.array([[200., 40., 20.], [40., 200., 30.], [200., 140., 20.]])
+            colonies['color'] = colors[rs.randint(0, len(colors), n)]
+            self._colonies = colonies
+        return(self._colonies)
+
+    def frame(self, t=None):
+        """
+        Synthetic RGB frame at experiment time t (hours)
+
+        Parameters
+        ----------
+        t : double
+            experiment time, default = the time of the next capture
+
+        Returns
+        -------
+        im: array_like
+            (H,W,3) uint8 image data
+        """
+        if t is None:
+            t = self.frame_count*self.dt
+        col = self._layout()
+        h,w = col['shape']
+        gain = self.shutter_speed/200000.
+
+        if self.gpio is None:
+            lit = True
+        elif self.led_pin is None:
+            lit = self.gpio.HIGH in self.gpio.pins.values()
+        else:
+            lit = self.gpio.input(self.led_pin) == self.gpio.HIGH
+
+        if not lit:
+            im = np.zeros((h,w,3))
+        else:
+            # uneven illumination background
+            xx,yy = np.ogrid[0:h, 0:w]
+            bg = 15 + 10*np.exp(-((xx-0.4*h)**2 + (yy-0.6*w)**2)/(0.5*w)**2)
+            im = np.repeat(bg[:,:,np.newaxis], 3, axis=2)
+
+            for i in range(self.n_colonies):
+                # sigmoid growth, as fluopi.analysis.f_sigma (not imported to keep
+                # the acquisition scripts light)
+                r = col['r_max'][i]/(1+np.exp(-(t+col['delay'][i])*col['rate'][i]))
+                if r < 0.5:
+                    continue
+                x1,x2 = int(max(col['x'][i]-r-1, 0)), int(min(col['x'][i]+r+2, h))
+                y1,y2 = int(max(col['y'][i]-r-1, 0)), int(min(col['y'][i]+r+2, w))
+                n,m = np.ogrid[x1:x2, y1:y2]
+                d2 = ((n-col['x'][i])**2 + (m-col['y'][i])**2)/(r*r)
+                profile = np.sqrt(np.clip(1-d2, 0, 1))
+                im[x1:x2,y1:y2,:] += profile[:,:,np.newaxis]*col['color'][i]
+
+        rs = np.random.RandomState(self.seed + 1 + self.frame_count)
+        im = im*gain + rs.normal(0, 2, im.shape)
+        return(np.clip(im, 0, 255).astype(np.uint8))
+
+    def capture(self, output, format=None, **options):
+        """
+        Capture a synthetic frame to a file name, a file-like object or a
+        numpy array (format 'rgb', padded as PiCamera does)
+        """
+        if self.capture_time:
+            time.sleep(self.capture_time)
+        im = self.frame()
+        self.frame_count += 1
+
+        if isinstance(output, np.ndarray):
+            output[:im.shape[0],:im.shape[1],:] = im
+            return
+        if format is None and isinstance(output, str):
+            format = os.path.splitext(output)[1][1:]
+        format = (format or 'jpeg').lower()
+
+        if format == 'rgb':
+            data = im.tobytes()
+        else:
+            buf = io.BytesIO()
+            Image.fromarray(im).save(buf, format='PNG' if format == 'png' else 'JPEG',
+                                     quality=95)
+            data = buf.getvalue()
+
+        if isinstance(output, str):
+            with open(output, 'wb') as f:
+                f.write(data)
+        else:
+            output.write(data)
+
+    def close(self):
+        self.closed = True
+
+
+def load_test(folder, steps=50, mode='memory', **sim_options):
+    """
+    Measure the throughput of the capture-to-analysis pipeline using the
+    simulated backend, capturing without waiting between frames. At the end
+    the colonies are detected again, checking that the colony series still
+    have one value per frame.
+
+    Parameters
+    ----------
+    folder : string
+        folder where the frames and results are written
+
+    steps : int
+        number of frames
+
+    mode : string
+        'memory' (in-memory handoff to the online analysis, see timelapse.py)
+        or 'file' (frames written to files and analysed from the folder)
+
+    sim_options:
+        options of SimulatedCamera
+
+    Returns
+    -------
+    fps: double
+        frames captured and analysed per second
+    """
+    import threading
+    from fluopi.acquisition import run_timelapse, FrameWriter, queue
+    from fluopi.daemon import AnalysisDaemon
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    gpio = FakeGPIO()
+    gpio.setmode(gpio.BOARD)
+    gpio.setup(29, gpio.OUT)
+    camera = SimulatedCamera(gpio=gpio, **sim_options)
+    analysis = AnalysisDaemon(folder, out_name='null')
+    writer = FrameWriter()
+
+    t1 = time.time()
+    if mode == 'memory':
+        frames = queue.Queue()
+        consumer = threading.Thread(target=analysis.consume, args=(frames,))
+        consumer.start()
+        run_timelapse(camera, gpio, 29, folder, 'sim', 0, steps, frames, writer)
+        frames.put(None)
+        consumer.join()
+        writer.close()
+    else:
+        run_timelapse(camera, gpio, 29, folder, 'sim', 0, steps, None, writer)
+        writer.close()
+        analysis.poll()
+    elapsed = time.time()-t1
+
+    # the series rebuilt when the colonies are detected again have to keep
+    # one value per processed frame
+    analysis.detect_colonies(analysis.thresh)
+    res = analysis.results()
+    lengths = set(len(v) for v in res['Radius'].values())
+    for c in res['Intensity']:
+        lengths |= set(len(v) for v in res['Intensity'][c].values())
+    if lengths - set([len(res['Times'])]):
+        raise RuntimeError('colony series of length ' + str(sorted(lengths)) + ' for ' +
+                           str(len(res['Times'])) + ' frames after detecting the colonies again')
+
+    print(str(steps) + ' frames in ' + str(elapsed) + ' secs')
+    return(steps/elapsed)
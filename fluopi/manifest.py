@@ -0,0 +1,346 @@
+import os
+import re
+import numpy as np
+
+from fluopi.analysis import (CHANNELS, CAPTURE_LOG, save_obj, load_obj, read_capture_log,
+                             file_timestamp, imread_reduced)
+
+# Frame number at the end of the file names, e.g. image_0012.jpg
+INDEX_PATTERN = re.compile(r'(\d+)\.[^.]+$')
+
+
+def manifest_name(file_type):
+    return('manifest_' + file_type)
+
+
+# Signature of the beginning and end of the image files
+HEADERS = {'jpg': (b'\xff\xd8', b'\xff\xd9'), 'jpeg': (b'\xff\xd8', b'\xff\xd9'),
+           'png': (b'\x89PNG', b'IEND\xaeB`\x82')}
+
+
+def _frame_index(name):
+    match = INDEX_PATTERN.search(name)
+    return(int(match.group(1)) if match else -1)
+
+
+def is_complete(f_name):
+    """
+    Cheap check of an image file, without decoding it: the file has to be
+    non empty and, for JPEG and PNG files, begin and end with the format
+    markers (a truncated file, e.g. written when the power was lost, lacks
+    the end marker)
+
+    Parameters
+    ----------
+    f_name : string
+        full path of the image file
+
+    Returns
+    -------
+    True if the file is complete
+    """
+    ext = os.path.splitext(f_name)[1][1:].lower()
+    size = os.path.getsize(f_name)
+    if ext not in HEADERS:
+        return(size > 0)
+    head, tail = HEADERS[ext]
+    if size < len(head) + len(tail):
+        return(False)
+    with open(f_name, 'rb') as f:
+        if f.read(len(head)) != head:
+            return(False)
+        f.seek(-len(tail), os.SEEK_END)
+        return(f.read(len(tail)) == tail)
+
+
+def build_manifest(path, file_type='jpg', refresh=True):
+    """
+    Index the image files of a folder scanning it only once (os.scandir) and
+    cache the result on the folder (manifest_<file_type>.pkl). For each file
+    it records the name, frame number, size, modification time,
+    acquisition time and acquisition configuration (from the capture log of
+    a sequenced time-lapse, see run_timelapse), and it detects the missing
+    frame numbers.
+
+    Each file is also checked with is_complete ('Valid'); files which fail
+    to decode when loaded with get_manifest_data are marked as not valid.
+
+    When a cached manifest exists only the new or modified files are
+    processed (incremental refresh for growing folders). Use refresh=False to
+    load the cached manifest without scanning the folder.
+
+    Parameters
+    ----------
+    path : string
+        folder name where the images are stored
+
+    file_type : string
+        extension of the image files (e.g. tif, png, jpg)
+
+    refresh : boolean
+        True to update the manifest with the current folder content
+
+    Returns
+    -------
+    manifest: dictionary
+        'Files', 'Index', 'Size', 'Mtime', 'Timestamps', 'Valid' and 'Config'
+        of each file sorted by frame number, 'Configs' with the names of the
+        configurations in capture order, 'Gaps' with the missing frame
+        numbers and 'Corrupt' with the frame numbers of the not valid files
+
+    """
+    name = manifest_name(file_type)
+    cached = os.path.exists(os.path.join(path, name + '.pkl'))
+    if cached:
+        manifest = load_obj(name, path)
+        if not refresh:
+            return(manifest)
+        entries = manifest['Entries']
+    else:
+        entries = {}
+
+    logged = {}
+    configs = {}
+    if os.path.exists(os.path.join(path, CAPTURE_LOG)):
+        log = read_capture_log(path)
+        logged = dict(zip(log['file'], log['timestamp']))
+        configs = dict(zip(log['file'], log.get('config', [])))
+
+    ext = '.' + file_type
+    current = {}
+    changed = 0
+    for entry in os.scandir(path):
+        if not entry.name.endswith(ext) or not entry.is_file():
+            continue
+        st = entry.stat()
+        old = entries.get(entry.name)
+        if old is not None and len(old) == 6 and old[1] == st.st_size and old[2] == st.st_mtime:
+            if logged.get(entry.name, '') != '' and float(logged[entry.name]) != old[3]:
+                # logged after the file was indexed (the log is written in background)
+                old = old[:3] + (float(logged[entry.name]), old[4],
+                                 configs.get(entry.name, ''))
+                changed += 1
+            current[entry.name] = old
+            continue
+        if logged.get(entry.name, '') != '':
+            ts = float(logged[entry.name])
+        else:
+            ts = file_timestamp(entry.path)
+        current[entry.name] = (_frame_index(entry.name), st.st_size, st.st_mtime, ts,
+                               is_complete(entry.path), configs.get(entry.name, ''))
+        changed += 1
+
+    if cached and changed == 0 and len(current) == len(entries):
+        return(manifest)
+
+    manifest = _assemble(path, file_type, current)
+    print(path.split('\\')[-1] + ' = ' + str(len(manifest['Files'])) + ' files, ' +
+          str(len(manifest['Gaps'])) + ' missing frames, ' +
+          str(len(manifest['Corrupt'])) + ' corrupt frames')
+    return(manifest)
+
+
+def _assemble(path, file_type, current):
+    """
+    Build (and save) the manifest arrays from the file entries
+    """
+    files = sorted(current, key=lambda f: (current[f][0], f))
+    manifest = {}
+    manifest['Path'] = path
+    manifest['Files'] = files
+    manifest['Index'] = np.array([current[f][0] for f in files], dtype=int)
+    manifest['Size'] = np.array([current[f][1] for f in files], dtype=np.int64)
+    manifest['Mtime'] = np.array([current[f][2] for f in files])
+    manifest['Timestamps'] = np.array([current[f][3] for f in files])
+    manifest['Valid'] = np.array([current[f][4] for f in files], dtype=bool)
+    manifest['Config'] = np.array([current[f][5] for f in files], dtype=object)
+    manifest['Configs'] = []
+    for f in sorted(files, key=lambda f: current[f][3]):
+        if current[f][5] not in manifest['Configs']:
+            manifest['Configs'].append(current[f][5])
+    idx = np.unique(manifest['Index'][manifest['Index'] >= 0])
+    if len(idx):
+        manifest['Gaps'] = sorted(set(range(idx[0], idx[-1]+1)) - set(idx.tolist()))
+    else:
+        manifest['Gaps'] = []
+    manifest['Corrupt'] = manifest['Index'][~manifest['Valid']].tolist()
+    manifest['file_type'] = file_type
+    manifest['Entries'] = current
+    save_obj(manifest, manifest_name(file_type), path)
+    return(manifest)
+
+
+def manifest_files(manifest):
+    """
+    Full path of the files of a manifest, in frame order. It can be used as
+    f_name on get_im_data, e.g.:
+    get_im_data(1, len(files), files)
+
+    Parameters
+    ----------
+    manifest: dictionary
+        folder manifest (from build_manifest)
+
+    Returns
+    -------
+    files: list
+        full path of each file
+    """
+    return([os.path.join(manifest['Path'], f) for f in manifest['Files']])
+
+
+def frame_selection(manifest, config=None):
+    """
+    Frame number of each file of a manifest and the files of one
+    acquisition configuration (see get_manifest_data)
+
+    Parameters
+    ----------
+    manifest: dictionary
+        folder manifest (from build_manifest)
+
+    config: string
+        name of the acquisition configuration, default = the first
+        configuration of the sequence
+
+    Returns
+    -------
+    idx: array_like
+        frame number of each file (position in name order when the file
+        names have no frame number)
+
+    use: array_like
+        True for the files of the configuration
+    """
+    idx = manifest['Index']
+    if len(idx) == 0:
+        raise IOError('no image files on ' + manifest['Path'])
+    if (idx < 0).all():
+        idx = np.arange(len(idx))       # no frame numbers, name order
+
+    configs = manifest.get('Configs', [''])
+    if config is None and len(configs) > 1:
+        config = configs[0]
+    if config is None:
+        use = np.ones((len(idx)), dtype=bool)
+        if len(np.unique(idx[idx >= 0])) < np.sum(idx >= 0):
+            print('WARNING: repeated frame numbers, use config to select the files')
+    else:
+        tag = '_' + str(config) + '_'
+        use = np.array([manifest['Config'][i] == config or
+                        (manifest['Config'][i] == '' and tag in manifest['Files'][i])
+                        for i in range(len(idx))], dtype=bool)
+        if not use.any():
+            raise IOError('no image files of configuration ' + str(config) + ' on ' +
+                          manifest['Path'])
+    return(idx, use)
+
+
+def get_manifest_data(manifest, x_frames=1, init=None, fill='interpolate', scale=1,
+                      config=None):
+    """
+    Load image data of the frames of a manifest tolerating missing and
+    corrupt files. Files which are not valid (see build_manifest) are not
+    decoded, and files which fail to decode are marked as not valid on the
+    saved manifest, so they are not read again on later loads. The frames
+    without data are interpolated from their neighbours or skipped.
+
+    On a sequenced time-lapse (several acquisition configurations sharing
+    the frame numbers) only the frames of one configuration are loaded.
+    When the file names have no frame number the files are used in name
+    order.
+
+    Parameters
+    ----------
+    manifest: dictionary
+        folder manifest (from build_manifest)
+
+    x_frames : int
+        step frames (e.g 10 to use only ten to ten images)
+
+    init: int
+        first frame number to be used, default = first frame of the folder
+
+    fill: string
+        'interpolate' to fill the missing frames with a linear interpolation
+        of the nearest good frames, or 'skip' to leave them out
+
+    scale: int
+        reduction factor of the image resolution (see imread_reduced)
+
+    config: string
+        name of the acquisition configuration to load (from the capture
+        log, or the files named *_config_*), default = the first
+        configuration of the sequence
+
+    Returns
+    -------
+    ImsR,ImsG,ImsB: array_like
+        data per channel of each image (ImsR -> matrix size = (W,H,frames))
+
+    frames: array_like
+        frame number of each time step of the data
+
+    filled: array_like
+        True for the time steps interpolated (all False with fill='skip')
+    """
+    idx, use = frame_selection(manifest, config)
+    files = manifest_files(manifest)
+    if config is None and len(manifest.get('Configs', [])) > 1:
+        print('loading configuration ' + str(manifest['Configs'][0]) + ' of ' +
+              str(manifest['Configs']))
+
+    by_index = {}
+    for i in range(len(idx)-1, -1, -1):
+        if use[i] and manifest['Valid'][i]:
+            by_index[idx[i]] = i        # first valid file of each frame number
+
+    numbered = idx[use & (idx >= 0)]
+    if len(numbered) == 0:
+        raise IOError('no image files with a frame number on ' + manifest['Path'])
+    first = numbered.min() if init is None else int(init)
+    frames = np.arange(first, numbered.max()+1, x_frames)
+    good = np.zeros((len(frames)), dtype=bool)
+
+    Ims = None
+    corrupt = []
+    for t in range(len(frames)):
+        i = by_index.get(frames[t])
+        if i is None:
+            continue
+        try:
+            im = imread_reduced(files[i], scale)
+        except Exception:
+            corrupt.append(manifest['Files'][i])
+            continue
+        if Ims is None:
+            Ims = np.zeros((im.shape[0], im.shape[1], len(frames), len(CHANNELS)))
+        Ims[:,:,t,:] = im[:,:,:len(CHANNELS)]
+        good[t] = True
+
+    if len(corrupt):
+        for name in corrupt:
+            entry = manifest['Entries'][name]
+            manifest['Entries'][name] = entry[:4] + (False,) + entry[5:]
+        manifest.update(_assemble(manifest['Path'], manifest['file_type'], manifest['Entries']))
+        print('corrupt frames: ' + str(corrupt))
+    if Ims is None:
+        raise IOError('no valid frames to load')
+
+    pos = np.nonzero(good)[0]
+    if fill == 'skip':
+        Ims = Ims[:,:,pos,:]
+        frames = frames[pos]
+        good = good[pos]
+    else:
+        for t in np.nonzero(~good)[0]:
+            before = pos[pos < t]
+            after = pos[pos > t]
+            if len(before) and len(after):
+                a,b = before[-1], after[0]
+                w = (t-a)/float(b-a)
+                Ims[:,:,t,:] = (1-w)*Ims[:,:,a,:] + w*Ims[:,:,b,:]
+            else:
+                Ims[:,:,t,:] = Ims[:,:,before[-1] if len(before) else after[0],:]
+
+    return(Ims[:,:,:,0], Ims[:,:,:,1], Ims[:,:,:,2], frames, ~good)
@@ -0,0 +1,378 @@
+"""
+Declarative description of the analysis of one plate, with the result of
+each stage cached on disk.
+
+A pipeline is a list of stages, each one with a function, its inputs (outputs
+of previous stages, as 'stage.Output') and the names of the parameters it
+uses. The cache key of a stage is a hash of its function, its parameter
+values and the keys of its inputs (the key of the first stage depends on the
+files of the folder), so when a parameter changes only that stage and the
+stages downstream are computed again, e.g. changing 'tl_thresh' reuses the
+detected colonies and their ROIs. Large outputs (the image data) are not
+kept on the cache and are computed again only when a stage needs them.
+
+The description (parameters and, optionally, stages) can be given as a
+dictionary or a JSON file, e.g. {"thresh": 0.3, "dt": 0.0833}
+"""
+import os
+import json
+import time
+import hashlib
+import importlib
+import numpy as np
+
+from fluopi.analysis import (CHANNELS, save_obj, load_obj, bg_grid, bg_surface_subst,
+                             smooth_data, colony_blobs_id, obtain_rois, roi_limits,
+                             channels_sum, frame_colony_radius, area, function_fit,
+                             croi_mean_int_frames)
+from fluopi.manifest import (build_manifest, manifest_files, get_manifest_data,
+                             frame_selection)
+
+# Analysis parameters (same names and default values as the example notebook)
+DEFAULT_PARAMS = {
+    'file_type': 'jpg',
+    'x_frames': 1,
+    'scale': 1,
+    'fill': 'interpolate',  # missing/corrupt frames (see get_manifest_data)
+    'config': None,         # acquisition configuration of a sequenced time-lapse
+    'dt': None,             # hours between frames, None to use the capture times
+    'tile': 64,             # background tiles (see bg_grid)
+    'percentile': 50,
+    'sigma': 0.7,           # smoothing filter (see smooth_data)
+    'thresh': 0.26,         # colony detection (see colony_blobs_id)
+    'r_min': 3,
+    'r_max': 11,
+    'max_over': 0.8,
+    'tl_thresh': 0.37,      # colony radius (see frame_colony_radius)
+    'fit_init': 10,         # fitted time steps (see function_fit)
+    'fit_end': -1,
+    'out_folder': 'fluopi_batch',
+}
+
+# Stages of the example notebook analysis. 'func' is the name of a function
+# of this module or a full 'module.function' path, 'inputs' maps each
+# argument to a stage output ('folder' is the plate folder and 'cache' the
+# folder of the cached results and figures) and 'save' lists the outputs
+# kept on the cache (all if not given).
+STAGES = [
+    {'name': 'load', 'func': 'stage_load', 'inputs': {'folder': 'folder'},
+     'params': ['file_type', 'x_frames', 'scale', 'fill', 'config', 'dt'],
+     'save': ['T', 'Frames', 'Filled', 'Last']},
+    {'name': 'background', 'func': 'stage_background', 'inputs': {'data': 'load.Data'},
+     'params': ['tile', 'percentile']},
+    {'name': 'smooth', 'func': 'stage_smooth',
+     'inputs': {'data': 'load.Data', 'grid': 'background.Grid'},
+     'params': ['tile', 'sigma'], 'save': ['Summary']},
+    {'name': 'detection', 'func': 'stage_detection',
+     'inputs': {'summary': 'smooth.Summary', 'im_name': 'load.Last', 'out': 'cache'},
+     'params': ['thresh', 'r_min', 'r_max', 'max_over']},
+    {'name': 'rois', 'func': 'stage_rois',
+     'inputs': {'smooth': 'smooth.Smooth', 'blobs': 'detection.Blobs'}, 'params': []},
+    {'name': 'radius', 'func': 'stage_radius',
+     'inputs': {'rois': 'rois.Rois', 'cols': 'rois.Cols'},
+     'params': ['tl_thresh', 'r_max']},
+    {'name': 'fluorescence', 'func': 'stage_fluorescence',
+     'inputs': {'rois': 'rois.Rois', 'lims': 'rois.Limits', 'cols': 'rois.Cols',
+                'blobs': 'detection.Blobs', 'radius': 'radius.Radius'}, 'params': []},
+    {'name': 'fit', 'func': 'stage_fit',
+     'inputs': {'T': 'load.T', 'radius': 'radius.Radius', 'cols': 'rois.Cols',
+                'out': 'cache'},
+     'params': ['fit_init', 'fit_end']},
+]
+
+
+def load_pipeline(fname=None):
+    """
+    Get a pipeline description: DEFAULT_PARAMS updated with the values of a
+    JSON file. The file can also define the stages with a "stages" list
+    (same format as STAGES).
+
+    Parameters
+    ----------
+    fname : string
+        path of the JSON file (None to use the default description)
+
+    Returns
+    -------
+    params: dictionary
+        analysis parameters, including the 'stages' list
+    """
+    params = dict(DEFAULT_PARAMS)
+    params['stages'] = STAGES
+    if fname is not None:
+        with open(fname) as f:
+            params.update(json.load(f))
+    return(params)
+
+
+def folder_hash(folder, file_type='jpg'):
+    """
+    Hash of the image files of a folder (names, sizes and modification
+    times, from build_manifest), without reading the images
+    """
+    manifest = build_manifest(folder, file_type)
+    h = hashlib.sha1()
+    h.update(json.dumps(manifest['Files']).encode())
+    h.update(np.ascontiguousarray(manifest['Size']).tobytes())
+    h.update(np.ascontiguousarray(manifest['Mtime']).tobytes())
+    return(h.hexdigest())
+
+
+class Pipeline(object):
+    """
+    Run the stages of a pipeline description on one plate folder, computing
+    each stage only when its result is not on the cache (see module
+    description). Stages are evaluated lazily: get('stage.Output') computes
+    only the stages needed for that output.
+
+    Parameters
+    ----------
+    folder : string
+        experiment folder with the time-lapse images of the plate
+
+    params : dictionary
+        analysis parameters and stages (see load_pipeline), missing values
+        take the DEFAULT_PARAMS and STAGES values
+
+    cache : string
+        folder of the cached results, default = params['out_folder'] on the
+        plate folder
+    """
+
+    def __init__(self, folder, params=None, cache=None):
+        self.folder = folder
+        self.params = load_pipeline()
+        self.params.update(params or {})
+        self.stages = dict((s['name'], s) for s in self.params['stages'])
+        self.order = [s['name'] for s in self.params['stages']]
+        if cache is None:
+            cache = os.path.join(folder, self.params['out_folder'])
+        self.cache = cache
+        if not os.path.exists(cache):
+            os.makedirs(cache)
+        self.results = {}
+        self._keys = {}
+
+    def key(self, name):
+        """
+        Cache key of a stage: hash of its function, parameter values and the
+        keys of its inputs
+        """
+        if name not in self._keys:
+            stage = self.stages[name]
+            desc = {'func': stage['func'],
+                    'params': dict((k, self.params[k]) for k in stage.get('params', []))}
+            inputs = {}
+            for arg, ref in stage.get('inputs', {}).items():
+                if ref == 'folder':
+                    inputs[arg] = folder_hash(self.folder, self.params['file_type'])
+                elif ref == 'cache':
+                    inputs[arg] = ref
+                else:
+                    inputs[arg] = self.key(ref.split('.')[0]) + '.' + ref.split('.')[1]
+            desc['inputs'] = inputs
+            data = json.dumps(desc, sort_keys=True, default=str).encode()
+            self._keys[name] = name + '_' + hashlib.sha1(data).hexdigest()[:16]
+        return(self._keys[name])
+
+    def cached(self, name):
+        """
+        True if the result of the stage is on the cache
+        """
+        return(os.path.exists(os.path.join(self.cache, self.key(name) + '.pkl')))
+
+    def stage(self, name):
+        """
+        Get the outputs of a stage, from memory, from the cache or computing it
+
+        Returns
+        -------
+        res: dictionary
+            outputs of the stage (only the saved ones when read from the cache)
+        """
+        res = self.results.get(name)
+        if res is None:
+            if self.cached(name):
+                res = load_obj(self.key(name), self.cache)
+                print(name + ': cached')
+            else:
+                res = self.compute(name)
+            self.results[name] = res
+        return(res)
+
+    def get(self, ref):
+        """
+        Get a stage output. Outputs not kept on the cache (e.g. 'load.Data')
+        are computed again when needed.
+
+        Parameters
+        ----------
+        ref : string
+            'stage.Output', e.g. 'detection.Blobs'
+
+        Returns
+        -------
+        value of the output
+        """
+        name, out = ref.split('.')
+        res = self.stage(name)
+        if out not in res:
+            res = self.compute(name)
+        return(res[out])
+
+    def compute(self, name):
+        """
+        Compute a stage (resolving its inputs) and save it on the cache
+
+        Returns
+        -------
+        res: dictionary
+            outputs of the stage
+        """
+        stage = self.stages[name]
+        args = {}
+        for arg, ref in stage.get('inputs', {}).items():
+            if ref == 'folder':
+                args[arg] = self.folder
+            elif ref == 'cache':
+                args[arg] = self.cache
+            else:
+                args[arg] = self.get(ref)
+        func = stage['func']
+        if '.' in func:
+            module, func = func.rsplit('.', 1)
+            func = getattr(importlib.import_module(module), func)
+        else:
+            func = globals()[func]
+
+        t1 = time.time()
+        res = func(self.params, **args)
+        print(name + ': computed in ' + str(round(time.time()-t1, 1)) + ' secs')
+        save = stage.get('save', list(res.keys()))
+        save_obj(dict((k, res[k]) for k in save), self.key(name), self.cache)
+        self.results[name] = res
+        return(res)
+
+    def run(self, targets=None):
+        """
+        Get the outputs of the given stages (default = all the stages)
+
+        Parameters
+        ----------
+        targets : list
+            names of the stages
+
+        Returns
+        -------
+        res: dictionary
+            outputs of each stage, res['stage']['Output']
+        """
+        if targets is None:
+            targets = self.order
+        return(dict((name, self.stage(name)) for name in targets))
+
+
+def stage_load(p, folder):
+    """
+    Image data of the plate tolerating missing or corrupt frames, and the
+    time of each frame (hours)
+    """
+    manifest = build_manifest(folder, p['file_type'])
+    R,G,B,frames,filled = get_manifest_data(manifest, p['x_frames'], fill=p['fill'],
+                                            scale=p['scale'], config=p.get('config'))
+    idx, use = frame_selection(manifest, p.get('config'))
+    if p['dt'] is None:
+        order = np.argsort(idx[use])
+        ts = np.interp(frames, idx[use][order], manifest['Timestamps'][use][order])
+        T = (ts - ts[0])/3600.
+    else:
+        T = (frames - frames[0])*p['dt']
+    # last frame loaded from a good file (files failing to decode are
+    # marked as not valid by get_manifest_data), shown by colony_blobs_id
+    good = np.nonzero(use & manifest['Valid'] & np.isin(idx, frames))[0]
+    last = good[np.argmax(idx[good])]
+    return({'Data': {'R': R, 'G': G, 'B': B}, 'T': T, 'Frames': frames, 'Filled': filled,
+            'Last': manifest_files(manifest)[last]})
+
+
+def stage_background(p, data):
+    """
+    Background value of each tile, channel and frame (see bg_grid)
+    """
+    return({'Grid': bg_grid(data, p['tile'], p['percentile'])})
+
+
+def stage_smooth(p, data, grid):
+    """
+    Background substracted and smoothed data (see smooth_data)
+    """
+    data = dict((c, data[c].copy()) for c in CHANNELS)
+    data = bg_surface_subst(data, grid, p['tile'])
+    _, sDatSall, sDatST = smooth_data(data, p['sigma'])
+    return({'Summary': sDatSall, 'Smooth': sDatST})
+
+
+def stage_detection(p, summary, im_name, out):
+    """
+    Colonies detected on the summary image (see colony_blobs_id)
+    """
+    Slims = [p['r_min']/(2**0.5), p['r_max']/(2**0.5)]
+    blobs = colony_blobs_id(summary, im_name, p['thresh'], sigma_lims=Slims,
+                            max_over=p['max_over'], filename=os.path.join(out, 'DetectedBlobs'))
+    return({'Blobs': blobs})
+
+
+def stage_rois(p, smooth, blobs):
+    """
+    Square ROIs of the smoothed data around each colony (see obtain_rois)
+    """
+    Rois,_,NC = obtain_rois(smooth, blobs)
+    for c in CHANNELS:
+        for i in Rois[c]:
+            Rois[c][i] = np.asarray(Rois[c][i], dtype=np.float32)  # smaller cache
+    lims = roi_limits(blobs, smooth[CHANNELS[0]].shape[:2])
+    return({'Rois': Rois, 'Limits': lims,
+            'Cols': [i for i in range(NC) if lims[i] is not None]})
+
+
+def stage_radius(p, rois, cols):
+    """
+    Radius of each colony over time (see frame_colony_radius)
+    """
+    if len(cols) == 0:
+        return({'Radius': {}})
+    ACRoisS = channels_sum(rois, cols)
+    return({'Radius': frame_colony_radius(ACRoisS, cols, p['tl_thresh'],
+                                          max_sig=p['r_max']/(2**0.5))})
+
+
+def stage_fluorescence(p, rois, lims, cols, blobs, radius):
+    """
+    Mean intensity inside the measured radius of each colony
+    (croi_mean_int_frames), computed on the ROIs instead of the whole frames
+    so the image data is not needed
+    """
+    MeanInt = dict((c, {}) for c in CHANNELS)
+    for i in cols:
+        x1,x2,y1,y2 = lims[i]
+        local = np.array([[blobs[i,0]-x1, blobs[i,1]-y1, blobs[i,2]]])
+        data = dict((c, rois[c][i]) for c in CHANNELS)
+        mean = croi_mean_int_frames(data, local, {0: radius[i]}, [0])
+        for c in CHANNELS:
+            MeanInt[c][i] = mean[c][0]
+    return({'MeanInt': MeanInt})
+
+
+def stage_fit(p, T, radius, cols, out):
+    """
+    Colony area and sigmoid fit of each colony (see area and function_fit),
+    colonies which can not be fitted are left out of 'Fit'
+    """
+    A = area(radius, cols, T, filename=os.path.join(out, 'Area'))
+    fit = {}
+    for i in cols:
+        try:
+            fit.update(function_fit(T, A, p['fit_init'], p['fit_end'], [i]))
+        except (RuntimeError, ValueError):
+            pass        # the sigmoid could not be fitted to this colony
+    return({'Area': A, 'Fit': fit})
@@ -2,10 +2,52 @@
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
+import time
+import tracemalloc
+import multiprocessing
+import subprocess
+from PIL import Image
 
 # Define the image channels
 CHANNELS = ['R','G','B']
 
+
+def rgb_image(data, frame='null'):
+    """
+    Compose the RGB image to display from the data of each channel. When
+    the channels are views of a single interleaved uint8 array (e.g. the
+    frames read with plt.imread) the image is returned as a view, without
+    copying; otherwise the channels are stacked once and clipped to uint8.
+
+    Parameters
+    ----------
+    data : dictionary
+        R G B data, (W,H) or (W,H,time) arrays
+
+    frame : int
+        time step of the image, 'null' to compose all the time steps
+
+    Returns
+    -------
+    image: array_like
+        (W,H,3) uint8 image, or (W,H,time,3) when frame = 'null'
+    """
+    chans = [data[c] if frame == 'null' else data[c][...,frame] for c in CHANNELS]
+    x = chans[0]
+    size = x.dtype.itemsize
+    interleaved = (all(isinstance(c, np.ndarray) and c.dtype == x.dtype and
+                       c.shape == x.shape and c.strides == x.strides for c in chans) and
+                   all(chans[k].__array_interface__['data'][0] ==
+                       x.__array_interface__['data'][0] + k*size for k in range(len(chans))))
+    if interleaved and x.base is not None:
+        image = np.lib.stride_tricks.as_strided(x, x.shape + (len(chans),),
+                                                x.strides + (size,), writeable=False)
+        if image.dtype == np.uint8:
+            return(image)
+        return(np.clip(image, 0, 255).astype(np.uint8))
+    return(np.clip(np.stack(chans, axis=-1), 0, 255).astype(np.uint8))
+
+
 def plot_im_frame(f_path,frame):
 
     """
@@ -109,11 +151,7 @@ def row_transect(data, row, data_frame=-1, title = 'Transect value', show_im = T
         #Rebuild the image
         
             n,m,l = data[CHANNELS[0]].shape
-            image = np.zeros((n,m,len(CHANNELS)))
-            for i in range(len(CHANNELS)):
-                image[:,:,i] = data[CHANNELS[i]][:,:,data_frame]
-                
-            image = image.astype('uint8')   #change the data type to show the image properly
+            image = rgb_image(data, data_frame)
 
             #plot selected line transect on the image        
 
@@ -187,7 +225,7 @@ def im_zoom(x_lims, y_lims, imagen):
     plt.colorbar()
 
     
-def rois_plt_fluo_dynam(rois, time_v, cv, filename='null'):
+def rois_plt_fluo_dynam(rois, time_v, cv, filename='null', traces='null'):
     """
     Plot the total fluorescence of each colony over time
 
@@ -204,16 +242,35 @@ def rois_plt_fluo_dynam(rois, time_v, cv, filename='null'):
         
         filename: string
             filename with whom save the output image with fluorescence dynamics
+
+        traces: dictionary
+            total fluorescence of each colony already computed (from a
+            previous call or rois_time_sum), to not compute it again
+
+    Returns
+    -------
+        traces: dictionary
+            (colony x time) total fluorescence for each channel (see rois_time_sum)
     """
+    from matplotlib.collections import LineCollection
+    from fluopi.analysis import rois_time_sum
+
+    if traces == 'null':
+        traces = rois_time_sum(rois, cv)
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    time_v = np.asarray(time_v)
 
     plt.figure(figsize=(17,3))
     POS_VECT = [131,132,133]
     count = 0
     for c in CHANNELS:
-        plt.subplot(POS_VECT[count])
-        for i in cv:
-            plt.plot(time_v,rois[c][i].sum(axis=(0,1)))   #sum the value
-            #plt.hold(True)
+        ax = plt.subplot(POS_VECT[count])
+        # one artist with all the colonies of the channel
+        segs = np.empty((len(cv), len(time_v), 2))
+        segs[:,:,0] = time_v
+        segs[:,:,1] = traces[c]
+        ax.add_collection(LineCollection(segs, colors=colors))
+        ax.autoscale_view()
 
         plt.xlabel('Time [h]')
         plt.ylabel('Fluorescence intensity')
@@ -223,6 +280,7 @@ def rois_plt_fluo_dynam(rois, time_v, cv, filename='null'):
     if filename != 'null':
         #plt.savefig("FluorIntRGB.pdf", transparent=True)
         plt.savefig(str(filename) + ".pdf", transparent=True)
+    return(traces)
 
 #plt.legend(['Colony %d'%i for i in range(len(A))])
 
@@ -279,7 +337,7 @@ def tl_roi(rois, times, idx, frames, fname = 'null', radius='null', chan_sum=Fal
                 mx = np.max(ROI[:,:,:])
             else:  
                 #Reconstruct an image file for each time
-                ROI = np.zeros((w1,h1,3))
+                ROI = dict((c, rois[c][idx]) for c in CHANNELS)
            
             
         # make the plot of each frame and save it
@@ -300,10 +358,7 @@ def tl_roi(rois, times, idx, frames, fname = 'null', radius='null', chan_sum=Fal
                     
                         
                 else:                #Plot the ROI original image
-                    ROI[:,:,0] = rois[CHANNELS[0]][idx][:,:,i]      #RED layer
-                    ROI[:,:,1] = rois[CHANNELS[1]][idx][:,:,i]      #GREEN layer
-                    ROI[:,:,2] = rois[CHANNELS[2]][idx][:,:,i]      #BlUE layer
-                    roi[i] = ROI.astype('uint8')
+                    roi[i] = rgb_image(ROI, i)
                     plt.imshow(roi[i])
                     plt.xticks([])
                     plt.yticks([])
@@ -361,7 +416,425 @@ def tl_roi(rois, times, idx, frames, fname = 'null', radius='null', chan_sum=Fal
         print('ERROR: use an integer value for the colony ID') 
         
 
-def logplot_radius(r, cv, t, filename='null'):
+def roi_frame(roi, r=None, vmin=None, vmax=None, zoom=8, cmap='viridis', color=(255,0,0),
+              lw=2):
+    """
+    Render one ROI frame directly to an RGB image array, without a figure.
+    The image is enlarged zoom times (nearest pixel, as imshow with
+    interpolation='none') and the colony circle is rasterised on it.
+
+    Parameters
+    ----------
+    roi: array_like
+        ROI data of the frame: (w,h,3) RGB values or (w,h) single channel
+        (e.g. the sum of channels), mapped with cmap between vmin and vmax
+
+    r: double
+        radius of the circle drawn around the ROI center (None = no circle)
+
+    vmin, vmax: double
+        color scale limits of single channel data (default = frame min/max)
+
+    zoom: int
+        enlargement factor of each side
+
+    cmap: string
+        matplotlib colormap of single channel data
+
+    color: tuple
+        RGB color of the circle
+
+    lw: double
+        width of the circle line (pixels of the enlarged image)
+
+    Returns
+    -------
+    im: array_like
+        (w*zoom,h*zoom,3) uint8 image
+    """
+    roi = np.asarray(roi)
+    if roi.ndim == 2:
+        vmin = roi.min() if vmin is None else vmin
+        vmax = roi.max() if vmax is None else vmax
+        norm = (roi - vmin)/float(vmax - vmin) if vmax > vmin else np.zeros(roi.shape)
+        im = plt.get_cmap(cmap)(np.clip(norm, 0, 1), bytes=True)[:,:,:3]
+    else:
+        im = roi if roi.dtype == np.uint8 else np.clip(roi, 0, 255).astype(np.uint8)
+    im = np.repeat(np.repeat(im, zoom, axis=0), zoom, axis=1)
+
+    if r is not None:
+        w1,h1 = roi.shape[:2]
+        # same center used by tl_roi for the circle artist, (x,y) = (col,row)
+        xc = round((w1-1)/2.)
+        yc = round((h1-1)/2.)
+        n,m = np.ogrid[0:im.shape[0], 0:im.shape[1]]
+        d = np.sqrt(((n+0.5)/zoom-0.5-yc)**2 + ((m+0.5)/zoom-0.5-xc)**2)
+        im[np.abs(d - r)*zoom <= lw/2.] = color
+    return(im)
+
+
+def _tl_roi_frame(args):
+    """
+    Worker of export_tl_roi: render a frame and save it if fname is given
+    """
+    roi, r, vmin, vmax, zoom, fname, keep = args
+    im = roi_frame(roi, r, vmin, vmax, zoom)
+    if fname is not None:
+        Image.fromarray(im).save(fname)
+    return(im if keep else None)
+
+
+def export_tl_roi(rois, times, idx, frames, fname='null', radius='null', chan_sum=False,
+                  same_bar=True, zoom=8, processes=None, video='null', fps=5):
+    """
+    Fast version of tl_roi to export the frames of a ROI: each frame is
+    rendered directly to an image array (see roi_frame) on a pool of worker
+    processes, instead of drawing and saving a figure per frame. The frames
+    can also be written to a video (GIF, or MP4 with ffmpeg) in the same
+    pass. Axes and colorbar are not drawn.
+
+    Parameters
+    ----------
+    rois: dictionary
+        RGB time-lapse image data of each rois, from obtain_rois()
+
+    times: vector
+        contain the experimental time vector
+
+    idx: int
+        contain the ID of the of the selected colony
+
+    frames: vector
+        conitains the selected time frames
+
+    fname: string
+        the complete filename to save the images of ROIs, formatted with the
+        frame time as on tl_roi, e.g. fname=('rois/Col'+str(idx)+'_ROI_step%d.png')
+
+    radius: vector
+        radius of the colony at each time step, to draw a circle around it
+
+    chan_sum: boolean
+        True to show the sum of the three channels of the ROI.
+        False to show the image original colors.
+
+    same_bar: boolean
+        True to use the same color scale on every frame (with chan_sum)
+
+    zoom: int
+        enlargement factor of the ROI images
+
+    processes: int
+        number of worker processes (default = number of CPUs, 1 = no pool)
+
+    video: string
+        filename of the video (.gif or .mp4), 'null' to not make it
+
+    fps: double
+        frames per second of the video
+
+    Returns
+    -------
+    ims: list
+        image array of each frame, only when a video is made (otherwise None)
+    """
+    if type(idx) != int:
+        print('ERROR: use an integer value for the colony ID')
+        return
+    if len(frames) == 0:
+        print('ERROR: Time vector have to be of lenght higher than zero')
+        return
+
+    if chan_sum == True:
+        ROI = rois[CHANNELS[0]][idx] + rois[CHANNELS[1]][idx] + rois[CHANNELS[2]][idx]
+        vmin, vmax = (0, ROI.max()) if same_bar == True else (None, None)
+    else:
+        ROI = dict((c, rois[c][idx]) for c in CHANNELS)
+        vmin, vmax = None, None
+
+    keep = video != 'null'
+    jobs = []
+    for i in frames:
+        roi = ROI[:,:,i] if chan_sum == True else rgb_image(ROI, i)
+        r = None if isinstance(radius, str) else radius[i]
+        f = fname%(times[i]) if fname != 'null' else None
+        jobs.append((roi, r, vmin, vmax, zoom, f, keep))
+
+    if processes == 1:
+        ims = [_tl_roi_frame(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            ims = pool.map(_tl_roi_frame, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    if not keep:
+        return
+    save_video(ims, video, fps)
+    return(ims)
+
+
+def save_video(ims, filename, fps=5):
+    """
+    Write a sequence of RGB image arrays as a video: GIF files are written
+    with PIL, other formats piping the raw frames to ffmpeg (path given by
+    matplotlib.rcParams['animation.ffmpeg_path'])
+
+    Parameters
+    ----------
+    ims: list
+        (w,h,3) uint8 image arrays of the same size
+
+    filename: string
+        video filename, e.g. 'Col7.mp4' or 'Col7.gif'
+
+    fps: double
+        frames per second
+    """
+    if filename.lower().endswith('.gif'):
+        frames_im = [Image.fromarray(im) for im in ims]
+        frames_im[0].save(filename, save_all=True, append_images=frames_im[1:],
+                          duration=int(1000./fps), loop=0)
+        return
+    w,h,_ = ims[0].shape
+    cmd = [matplotlib.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+           '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d'%(h,w), '-r', str(fps),
+           '-i', '-', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p',
+           filename]
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    except OSError:
+        print('ERROR: ffmpeg was not found, use a .gif filename or install ffmpeg')
+        return
+    for im in ims:
+        proc.stdin.write(np.ascontiguousarray(im, dtype=np.uint8).tobytes())
+    proc.stdin.close()
+    proc.wait()
+
+
+def roi_mosaic(rois, frames, cv='null', ncols='null', radius='null', norm='tile',
+               cmap='viridis', pad=1, color=(255,0,0)):
+    """
+    Pack the ROIs of many colonies in a single tiled image per time step, to
+    review a whole plate at once. ROIs of the same size are copied together
+    (one array copy per ROI size) and the radius circles are rasterised for
+    all the tiles at once.
+
+    Parameters
+    ----------
+    rois: dictionary
+        RGB time-lapse image data of each ROI (rois['channel'][idx], from
+        obtain_rois) or single channel data of each ROI (rois[idx], e.g.
+        from channels_sum), mapped with cmap
+
+    frames: vector
+        time steps to include
+
+    cv: vector
+        ID of the colonies to include, default = all the non empty ROIs
+
+    ncols: int
+        number of tiles per row, default = square mosaic
+
+    radius: dictionary
+        radius of each colony at each time step, e.g. from
+        frame_colony_radius, drawn as a circle on each tile
+
+    norm: string
+        intensity normalisation, of single channel and RGB data: 'tile'
+        (each tile scaled to its own range over the frames), 'frame' (each
+        tile and frame scaled on its own), 'global' (same scale for all the
+        tiles) or 'none' (values used as they are, 0-255 RGB data or 0-1
+        single channel data)
+
+    cmap: string
+        matplotlib colormap of single channel data
+
+    pad: int
+        pixels between tiles
+
+    color: tuple
+        RGB color of the radius circles
+
+    Returns
+    -------
+    mosaic: array_like
+        (W,H,3,frames) uint8 image of each time step
+
+    pos: dictionary
+        (row,col) pixel position of the top-left corner of each colony tile
+    """
+    rgb = CHANNELS[0] in rois
+    first = rois[CHANNELS[0]] if rgb else rois
+    if cv == 'null':
+        cv = [i for i in sorted(first) if len(first[i])]
+    frames = list(frames)
+    N = len(cv)
+    tw = max(first[i].shape[0] for i in cv)
+    th = max(first[i].shape[1] for i in cv)
+    nch = len(CHANNELS) if rgb else 1
+
+    # tiles[colony, x, y, channel, frame], each ROI centered on its tile
+    tiles = np.zeros((N, tw, th, nch, len(frames)), dtype=np.float32)
+    centers = np.zeros((N, 2))
+    inside = np.zeros((N, tw, th, 1, 1), dtype=bool)     # ROI pixels of each tile
+    shapes = {}
+    for k in range(N):
+        shapes.setdefault(first[cv[k]].shape[:2], []).append(k)
+    for (w,h), ks in shapes.items():
+        ox = int((tw-w)/2)
+        oy = int((th-h)/2)
+        if rgb:
+            block = np.stack([np.stack([rois[c][cv[k]][:,:,frames] for c in CHANNELS], axis=2)
+                              for k in ks])
+        else:
+            block = np.stack([rois[cv[k]][:,:,frames] for k in ks])[:,:,:,np.newaxis,:]
+        tiles[ks, ox:ox+w, oy:oy+h] = block
+        inside[ks, ox:ox+w, oy:oy+h] = True
+        # (row,col) of the ROI center on the tile, as tl_roi and ROIRenderer
+        centers[ks] = (ox + round((w-1)/2.), oy + round((h-1)/2.))
+
+    # the channels of a tile are scaled together, keeping the colours, with
+    # the range of the ROI pixels only (not the padding of smaller ROIs)
+    if norm != 'none':
+        axes = {'global': None, 'frame': (1,2,3)}.get(norm, (1,2,3,4))
+        lo = np.where(inside, tiles, np.inf).min(axis=axes, keepdims=True)
+        hi = np.where(inside, tiles, -np.inf).max(axis=axes, keepdims=True)
+        tiles = np.where(inside, (tiles - lo)/np.maximum(hi - lo, 1e-12), 0)
+    if rgb:
+        scale = 255 if norm != 'none' else 1
+        ims = np.clip(tiles*scale, 0, 255).astype(np.uint8)
+    else:
+        ims = plt.get_cmap(cmap)(tiles[:,:,:,0,:], bytes=True)[...,:3]    # (N,tw,th,frames,3)
+        ims = ims.transpose(0,1,2,4,3)
+
+    if radius != 'null':
+        r = np.array([[radius[i][t] for t in frames] for i in cv])          # (N,frames)
+        n,m = np.ogrid[0:tw, 0:th]
+        d = np.sqrt((n[np.newaxis] - centers[:,0,np.newaxis,np.newaxis])**2 +
+                    (m[np.newaxis] - centers[:,1,np.newaxis,np.newaxis])**2)
+        ring = np.abs(d[:,:,:,np.newaxis] - r[:,np.newaxis,np.newaxis,:]) <= 0.5
+        ring = ring & (r[:,np.newaxis,np.newaxis,:] > 0)
+        ims = ims.transpose(0,1,2,4,3)
+        ims[ring] = color
+        ims = ims.transpose(0,1,2,4,3)
+
+    # place the tiles on the grid with one reshape
+    if ncols == 'null':
+        ncols = int(np.ceil(np.sqrt(N)))
+    nrows = int(np.ceil(N/float(ncols)))
+    grid = np.full((nrows*ncols, tw+pad, th+pad, 3, len(frames)), 255, dtype=np.uint8)
+    grid[:N, :tw, :th] = ims
+    mosaic = grid.reshape((nrows, ncols, tw+pad, th+pad, 3, len(frames)))
+    mosaic = mosaic.transpose(0,2,1,3,4,5).reshape((nrows*(tw+pad), ncols*(th+pad), 3,
+                                                    len(frames)))
+    pos = dict((cv[k], (int(k/ncols)*(tw+pad), (k%ncols)*(th+pad))) for k in range(N))
+    return(mosaic, pos)
+
+
+def plt_mosaic(mosaic, pos, frame=-1, labels=True, title='null', filename='null'):
+    """
+    Plot one time step of a ROI mosaic (from roi_mosaic) with the colony IDs
+
+    Parameters
+    ----------
+    mosaic: array_like
+        mosaic images, from roi_mosaic
+
+    pos: dictionary
+        tile position of each colony, from roi_mosaic
+
+    frame: int
+        position of the time step on the mosaic
+
+    labels: boolean
+        True to write the colony ID on each tile
+
+    title: string
+        title of the plot
+
+    filename: string
+        filename to save the plot generated
+    """
+    plt.figure(figsize=(12,12))
+    plt.imshow(mosaic[:,:,:,frame], interpolation='none')
+    plt.xticks([])
+    plt.yticks([])
+    if labels == True:
+        for i in pos:
+            plt.annotate(str(i), xy=(pos[i][1], pos[i][0]), xytext=(1, -1),
+                         textcoords='offset points', ha='left', va='top', color='white',
+                         fontsize=6)
+    if title != 'null':
+        plt.title(title)
+    if filename != 'null':
+        plt.savefig(str(filename)+".pdf", transparent=True)
+
+
+def decimate_minmax(t, Y, max_points):
+    """
+    Reduce long series for display keeping the minimum and maximum of each
+    block of consecutive points, so peaks and outliers are still visible
+
+    Parameters
+    ----------
+        t: vector
+            time values of the series
+
+        Y: array like
+            (series x time) values
+
+        max_points: int
+            maximum number of points kept for each series
+
+    Returns
+    -------
+        td, Yd: array like
+            (series x points) time and values of the decimated series
+    """
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    N,T = Y.shape
+    t = np.broadcast_to(np.asarray(t, dtype=float), (N,T))
+    if T <= max_points:
+        return(t, Y)
+    block = int(np.ceil(T/(max(max_points, 2)/2.)))
+    nb = int(np.ceil(T/float(block)))
+    pad = nb*block - T
+    # repeat the last point to fill the last block
+    Yb = np.concatenate([Y, np.repeat(Y[:,-1:], pad, axis=1)], axis=1).reshape((N,nb,block))
+    tb = np.concatenate([t, np.repeat(t[:,-1:], pad, axis=1)], axis=1).reshape((N,nb,block))
+    Ym = np.where(np.isnan(Yb), np.inf, Yb)
+    imin = Ym.argmin(axis=2)
+    imax = np.where(np.isnan(Yb), -np.inf, Yb).argmax(axis=2)
+    ix = np.sort(np.stack([imin, imax], axis=2), axis=2)       # keep the time order
+    Yd = np.take_along_axis(Yb, ix, axis=2).reshape((N, 2*nb))
+    td = np.take_along_axis(tb, ix, axis=2).reshape((N, 2*nb))
+    return(td, Yd)
+
+
+def _series_plot(t, Y, labels, max_points):
+    """
+    Plot many series as dots, with the colors of the matplotlib color cycle.
+    All the series of the same color are drawn with a single artist, and
+    the legend is added once (labels = 'null' for no legend)
+    """
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    if max_points != 'null':
+        t, Y = decimate_minmax(t, Y, max_points)
+    else:
+        t = np.broadcast_to(np.asarray(t, dtype=float), Y.shape)
+    ax = plt.gca()
+    for k in range(min(len(colors), len(Y))):
+        ax.plot(t[k::len(colors)].ravel(), Y[k::len(colors)].ravel(), '.', color=colors[k])
+    if labels != 'null':
+        handles = [matplotlib.lines.Line2D([], [], ls='', marker='.',
+                                           color=colors[k%len(colors)]) for k in range(len(Y))]
+        ax.legend(handles, labels, loc='best')
+
+
+def logplot_radius(r, cv, t, filename='null', max_points='null'):
     """
     Plot the log of the square of the radius for each colony
     
@@ -377,20 +850,23 @@ def logplot_radius(r, cv, t, filename='null'):
             the vector of real time values
         filename: string
             filename to save the plot generated
+
+        max_points: int
+            maximum number of points shown per colony (see decimate_minmax),
+            default = all the points
     """
-    for i in cv:
-        R = r[i]
-        plt.plot(t, np.log(R*R), '.')
-        #plt.hold(True)
-        plt.xlabel('Time [h]')
-        plt.ylabel('log(Radius^2) [pixels]')
-        plt.title('Colony radius')
+    R = np.array([r[i] for i in cv], dtype=float)
+    with np.errstate(divide='ignore'):
+        _series_plot(t, np.log(R*R), 'null', max_points)
+    plt.xlabel('Time [h]')
+    plt.ylabel('log(Radius^2) [pixels]')
+    plt.title('Colony radius')
      
     if filename != 'null':    
         #plt.savefig("Radius.pdf", transparent=True)
         plt.savefig(str(filename)+".pdf", transparent=True)
 
-def plot_radius(r, cv, t, col_label=True, filename='null'):
+def plot_radius(r, cv, t, col_label=True, filename='null', max_points='null'):
     """
     Plot the radius for each colony at each time step
     
@@ -410,19 +886,17 @@ def plot_radius(r, cv, t, col_label=True, filename='null'):
             
         filename: string
             filename to save the plot generated
+
+        max_points: int
+            maximum number of points shown per colony (see decimate_minmax),
+            default = all the points
     """
-    for i in cv:
-        R = r[i]
-        
-        if col_label == True:
-            plt.plot(t,R, '.',label='colony '+str(i))
-            plt.legend(loc='best')
-        else:
-            plt.plot(t,R, '.')
-            
-        plt.xlabel('Time [h]')
-        plt.ylabel('Radius [pixels]')
-        plt.title('Colony radius')     
+    R = np.array([r[i] for i in cv], dtype=float)
+    labels = ['colony '+str(i) for i in cv] if col_label == True else 'null'
+    _series_plot(t, R, labels, max_points)
+    plt.xlabel('Time [h]')
+    plt.ylabel('Radius [pixels]')
+    plt.title('Colony radius')     
      
     if filename != 'null':    
         #plt.savefig("Radius.pdf", transparent=True)
@@ -539,7 +1013,417 @@ def check_radius(rois, idx, t, r_fit='null', r_dots='null', filename='null', tra
         #plt.savefig("KymoGraph.pdf", transparent=True) 
         plt.savefig(str(filename)+".pdf", transparent=True)
         
-def rois_last_frame_2chan_plt(rois_data, channel_x, channel_y, serie_name):
+class ROIRenderer(object):
+    """
+    Figure reused to show many ROI images, e.g. browsing or exporting colony
+    after colony. The figure, axes and artists are created once and each
+    call to show() or kymograph() only updates the image data, circle,
+    lines and title in place, redrawing just those artists (blitting) when
+    the image size does not change. Equivalent to the plots of tl_roi,
+    ROI_radius and check_radius.
+
+    Parameters
+    ----------
+    rois: dictionary
+        RGB time-lapse image data of each ROI (rois['channel'][idx], from
+        obtain_rois) or single channel data of each ROI (rois[idx], e.g.
+        from channels_sum)
+
+    figsize: tuple
+        size of the figure (inches)
+
+    cmap: string
+        colormap of single channel data
+
+    same_bar: boolean
+        True to use the same color scale (0 to the ROI maximum) on every
+        frame of a colony, False to scale each frame
+
+    Examples
+    --------
+    >>> view = ROIRenderer(ACRoisS)
+    >>> for i in Cols:
+    ...     view.show(i, -1, r=R_frame[i][-1])
+    ...     view.save('ROIs/Col%d.png'%i)
+    """
+
+    def __init__(self, rois, figsize=(8,8), cmap='gray', same_bar=True):
+        self.rois = rois
+        self.rgb = CHANNELS[0] in rois
+        self.same_bar = same_bar
+        self.fig = plt.figure(figsize=figsize)
+        self.ax = self.fig.gca()
+        self.ax.set_xticks([])
+        self.ax.set_yticks([])
+        self.im = self.ax.imshow(np.zeros((2,2)), interpolation='none', cmap=cmap,
+                                 animated=True)
+        self.circle = plt.Circle((0,0), 1, color='r', fill=False, lw=2, animated=True,
+                                 visible=False)
+        self.ax.add_artist(self.circle)
+        self.transect, = self.ax.plot([], [], 'r-', lw=1, animated=True)
+        self.fit_lines = self.ax.plot([], [], 'r-', [], [], 'r-', animated=True)
+        self.dot_lines = self.ax.plot([], [], 'rx', [], [], 'rx', ms=9, animated=True)
+        self.title = self.ax.set_title('', animated=True)
+        self._artists = ([self.im, self.circle, self.transect, self.title] +
+                         self.fit_lines + self.dot_lines)
+        self._shape = None
+        self._background = None
+        self._vmax = {}
+        self._visible = {}          # visibility of each artist, kept while blitting
+
+    def _colony(self, idx):
+        if self.rgb:
+            return(dict((c, self.rois[c][idx]) for c in CHANNELS))
+        return(self.rois[idx])
+
+    def _draw(self, shape):
+        """
+        Redraw the changed artists, the whole figure only when the image
+        size changes
+        """
+        canvas = self.fig.canvas
+        if shape != self._shape or self._background is None:
+            self.im.set_extent((-0.5, shape[1]-0.5, shape[0]-0.5, -0.5))
+            self.ax.set_xlim(-0.5, shape[1]-0.5)
+            self.ax.set_ylim(shape[0]-0.5, -0.5)
+            self._shape = shape
+            for a in self._artists:
+                a.set_visible(False)
+            canvas.draw()
+            self._background = canvas.copy_from_bbox(self.fig.bbox)
+            for a in self._artists:
+                a.set_visible(self._visible.get(a, True))
+        canvas.restore_region(self._background)
+        for a in self._artists:
+            if a.get_visible():
+                self.fig.draw_artist(a)
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def _set_visible(self, artist, visible):
+        self._visible[artist] = visible
+        artist.set_visible(visible)
+
+    def show(self, idx, frame=-1, r=None, transect=False, title=None):
+        """
+        Show one frame of a ROI (as tl_roi and ROI_radius)
+
+        Parameters
+        ----------
+        idx: int
+            id of the colony
+
+        frame: int
+            time step to show
+
+        r: double
+            colony radius, to draw a circle around the ROI center (None = no circle)
+
+        transect: boolean
+            True to draw the middle transect line
+
+        title: string
+            title of the plot
+        """
+        data = self._colony(idx)
+        roi = rgb_image(data, frame) if self.rgb else data[...,frame]
+        rw,cl = roi.shape[:2]
+        self.im.set_data(roi)
+        if not self.rgb:
+            if self.same_bar:
+                if idx not in self._vmax:
+                    self._vmax[idx] = data.max()
+                self.im.set_clim(0, self._vmax[idx])
+            else:
+                self.im.set_clim(roi.min(), roi.max())
+
+        self._set_visible(self.circle, r is not None)
+        if r is not None:
+            self.circle.set_center((round((rw-1)/2.), round((cl-1)/2.)))
+            self.circle.set_radius(r)
+        self._set_visible(self.transect, transect)
+        self.transect.set_data([-0.5, cl-0.5], [int((rw-1)/2)]*2)
+        for line in self.fit_lines + self.dot_lines:
+            self._set_visible(line, False)
+        self.title.set_text('Colony '+str(idx) if title is None else title)
+        self._draw(roi.shape[:2])
+
+    def kymograph(self, idx, r_fit=None, r_dots=None, transect=False, title=None):
+        """
+        Show the middle transect of a ROI over time, with the colony radius
+        estimates (as check_radius). Use it with single channel data.
+
+        Parameters
+        ----------
+        idx: int
+            id of the colony
+
+        r_fit: vector
+            colony fitted radius at each time step (None = not drawn)
+
+        r_dots: vector
+            colony radius at each time step, from frame_colony_radius (None = not drawn)
+
+        transect: boolean
+            True to draw the middle transect line
+
+        title: string
+            title of the plot
+        """
+        data = self._colony(idx)
+        w,h,nt = data.shape
+        kymo = data[int(round((w-1)/2)),:,:]
+        self.im.set_data(kymo)
+        self.im.set_clim(kymo.min(), kymo.max())
+
+        self._set_visible(self.circle, False)
+        self._set_visible(self.transect, transect)
+        self.transect.set_data([0, nt-1], [int((h-1)/2)]*2)
+        t = np.arange(nt)
+        for lines, r in ((self.fit_lines, r_fit), (self.dot_lines, r_dots)):
+            for line, sign in zip(lines, (-1, 1)):
+                self._set_visible(line, r is not None)
+                if r is not None:
+                    line.set_data(t, sign*np.asarray(r)+(h-1)/2.)
+        self.title.set_text('Colony '+str(idx) if title is None else title)
+        self._draw(kymo.shape)
+
+    def save(self, filename, **kwargs):
+        """
+        Save the current figure (e.g. 'Col7.png')
+        """
+        for a in self._artists:
+            a.set_animated(False)
+        self.fig.savefig(filename, **kwargs)
+        for a in self._artists:
+            a.set_animated(True)
+        self._background = None     # the saved draw includes the artists
+
+    def close(self):
+        plt.close(self.fig)
+
+
+class KymographViewer(object):
+    """
+    Interactive browser of the colony kymographs precomputed with
+    roi_transects: the center transect of the ROI over time with the
+    colony radius estimates, as check_radius. Only the image data and lines
+    of a single figure are updated when the colony changes.
+
+    Keys: right/left (or n/p) next/previous colony, c to switch between the
+    center row and the center column.
+
+    Parameters
+    ----------
+    kymo: dictionary
+        transects from roi_transects
+
+    t: vector
+        the vector of real time values
+
+    r_fit: dictionary
+        fitted radius of each colony at each time step (optional)
+
+    r_dots: dictionary
+        radius of each colony at each time step, from frame_colony_radius (optional)
+
+    Examples
+    --------
+    >>> kymo = flua.roi_transects(ACRoisS, Cols, 'kymographs', 'Data')
+    >>> view = flup.KymographViewer(kymo, T, r_fit, R_frame)
+    """
+
+    def __init__(self, kymo, t, r_fit='null', r_dots='null', figsize=(18,7)):
+        self.kymo = kymo
+        self.t = np.asarray(t)
+        self.r_fit = r_fit
+        self.r_dots = r_dots
+        self.axis = 'Rows'
+        self.pos = 0
+
+        self.fig = plt.figure(figsize=figsize)
+        self.ax = self.fig.gca()
+        self.im = self.ax.imshow(np.zeros((2,2)), interpolation='none')
+        self.fig.colorbar(self.im, fraction=0.03)
+        self.fit_lines = self.ax.plot([], [], 'r-', [], [], 'r-')
+        self.dot_lines = self.ax.plot([], [], 'rx', [], [], 'rx', ms=9)
+        self.ax.set_xlabel('Time')
+        step = max(int(len(self.t)*0.1), 1)
+        self.ax.set_xticks(range(0, len(self.t), step))
+        self.ax.set_xticklabels(self.t[0:len(self.t):step].astype(int))
+        self.fig.canvas.mpl_connect('key_press_event', self._on_key)
+        self.select(0)
+
+    def select(self, pos, axis=None):
+        """
+        Show a colony
+
+        Parameters
+        ----------
+        pos: int
+            position of the colony on kymo['Ids']
+
+        axis: string
+            'Rows' or 'Cols' transects, default = the current one
+        """
+        if axis is not None:
+            self.axis = axis
+        self.pos = pos % len(self.kymo['Ids'])
+        idx = self.kymo['Ids'][self.pos]
+        n = self.kymo['Length'][self.pos, 0 if self.axis == 'Rows' else 1]
+        data = self.kymo[self.axis][self.pos,:n,:]
+
+        self.im.set_data(data)
+        self.im.set_extent((-0.5, data.shape[1]-0.5, n-0.5, -0.5))
+        self.im.set_clim(np.nanmin(data), np.nanmax(data))
+        self.ax.set_xlim(-0.5, data.shape[1]-0.5)
+        self.ax.set_ylim(n-0.5, -0.5)
+        for lines, r in ((self.fit_lines, self.r_fit), (self.dot_lines, self.r_dots)):
+            for line, sign in zip(lines, (-1, 1)):
+                if r != 'null' and idx in r:
+                    line.set_data(np.arange(len(r[idx])), sign*np.asarray(r[idx])+(n-1)/2.)
+                else:
+                    line.set_data([], [])
+        self.ax.set_ylabel(('y' if self.axis == 'Rows' else 'x') + '-axis position')
+        self.ax.set_title('Colony '+str(idx))
+        self.fig.canvas.draw_idle()
+
+    def _on_key(self, event):
+        if event.key in ('right', 'n'):
+            self.select(self.pos+1)
+        elif event.key in ('left', 'p'):
+            self.select(self.pos-1)
+        elif event.key == 'c':
+            self.select(self.pos, 'Cols' if self.axis == 'Rows' else 'Rows')
+
+    def save(self, filename):
+        """
+        Save the current kymograph as filename.pdf
+        """
+        self.fig.savefig(str(filename)+".pdf", transparent=True)
+
+
+class RenderContext(object):
+    """
+    Context to make figures without a display (batch runs, worker
+    processes): a non-interactive backend is used inside the context, the
+    figures created by the functions run with call() are tracked and closed
+    on exit (the figures open before entering are not touched), and the
+    time and memory used to create and draw each figure are recorded.
+
+    Switching the backend closes all the open figures (see
+    plt.switch_backend), so it is only switched when the current backend is
+    not already the requested one, and restored on exit.
+
+    Parameters
+    ----------
+    backend: string
+        non-interactive matplotlib backend (e.g. 'Agg', 'pdf', 'svg')
+
+    profile: boolean
+        True to measure the memory (tracemalloc) and drawing time of each
+        figure. Tracing the memory slows down the rendering, use False to
+        only track and close the figures.
+
+    Examples
+    --------
+    >>> with flup.RenderContext() as ctx:
+    ...     ctx.call(flup.plot_radius, R, Cols, T, filename='radius')
+    ...     ctx.call(flup.rois_plt_fluo_dynam, ACRoisS, T, Cols, filename='fluo')
+    >>> ctx.report()
+    """
+
+    def __init__(self, backend='Agg', profile=True):
+        self.backend = backend
+        self.profile = profile
+        self.stats = []
+        self._old_backend = None
+
+    def __enter__(self):
+        if matplotlib.get_backend().lower() != self.backend.lower():
+            self._old_backend = matplotlib.get_backend()
+            plt.switch_backend(self.backend)
+        self._before = set(plt.get_fignums())
+        self._tracing = self.profile and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        return(self)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Run a plotting function and record its new figures. The function
+        draws on a new figure when it does not create its own.
+
+        Parameters
+        ----------
+        func: function
+            plotting function (e.g. plot_radius), called with args and kwargs
+
+        Returns
+        -------
+        the value returned by func
+        """
+        old = set(plt.get_fignums())
+        if self.profile:
+            mem0 = tracemalloc.get_traced_memory()[0]
+        t1 = time.time()
+        # new current figure for the functions drawing on it (e.g. plot_radius)
+        blank = plt.figure()
+        res = func(*args, **kwargs)
+        if not blank.axes:
+            plt.close(blank)
+        secs = time.time() - t1
+        new = sorted(set(plt.get_fignums()) - old)
+        name = getattr(func, '__name__', str(func))
+        for num in new:
+            stat = {'function': name, 'figure': num, 'create': secs/len(new),
+                    'draw': 'null', 'memory': 'null'}
+            if self.profile:
+                fig = plt.figure(num)
+                t1 = time.time()
+                fig.canvas.draw()
+                stat['draw'] = time.time() - t1
+                # memory still held by the figures of the call
+                stat['memory'] = (tracemalloc.get_traced_memory()[0] - mem0)/float(len(new))
+            self.stats.append(stat)
+        return(res)
+
+    def figures(self):
+        """
+        Returns
+        -------
+        list of the figures created inside the context still open
+        """
+        return([plt.figure(n) for n in plt.get_fignums() if n not in self._before])
+
+    def close(self):
+        """
+        Close the figures created inside the context
+        """
+        for fig in self.figures():
+            plt.close(fig)
+
+    def __exit__(self, *exc):
+        self.close()
+        if self._tracing:
+            tracemalloc.stop()
+        if self._old_backend is not None:
+            plt.switch_backend(self._old_backend)
+            self._old_backend = None
+        return(False)
+
+    def report(self):
+        """
+        Print the time (secs) and memory (MB) used by each figure
+        """
+        print('function              figure  create  draw  memory')
+        for s in self.stats:
+            print('%-22s %5d  %6.2f  %s  %s' % (s['function'], s['figure'], s['create'],
+                  '%5.2f'%s['draw'] if s['draw'] != 'null' else '    -',
+                  '%6.1f'%(s['memory']/1e6) if s['memory'] != 'null' else '     -'))
+
+
+def rois_last_frame_2chan_plt(rois_data, channel_x, channel_y, serie_name, features='null'):
     """
     Sum all the pixel values for channel_x and channel_y (e.g.channel G and 
     channel R) separately for the last frame of each ROI and make a plot where 
@@ -561,16 +1445,22 @@ def rois_last_frame_2chan_plt(rois_data, channel_x, channel_y, serie_name):
 
         serie_name: string
             name of the the data serie in analysis (used as title of the plot)
+
+        features: dictionary
+            ROI sums already computed with rois_features (its last frame is
+            used), to not compute them again
+
+    Returns
+    -------
+        chanx, chany: array like
+            (N,1) sum of each channel for each ROI
     """
-      
-    # variable inicialization
-    chanx = np.zeros((len(rois_data[channel_x]),1))
-    chany = np.zeros((len(rois_data[channel_x]),1))
-    
-    # perform the sum of selected channels for the last frame of each ROI
-    for i in range(len(rois_data[channel_x])):
-        chanx[i] = rois_data[channel_x][i][:,:,-1].sum(axis=(0,1))
-        chany[i] = rois_data[channel_y][i][:,:,-1].sum(axis=(0,1))
+    from fluopi.analysis import rois_features
+
+    if features == 'null':
+        features = rois_features(rois_data, [-1], list(range(len(rois_data[channel_x]))))
+    chanx = features['Sum'][:, CHANNELS.index(channel_x), -1:]
+    chany = features['Sum'][:, CHANNELS.index(channel_y), -1:]
     
     # size the plot dimentions
     axisMax = np.max([np.max(chanx), np.max(chany)])
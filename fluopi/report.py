@@ -0,0 +1,306 @@
+"""
+Per-plate report with the standard FluoPi figures (detected colonies,
+colony radius, area, fluorescence dynamics and channels relation) and the
+summary of the analysis, as a single self-contained HTML file (images
+embedded) and/or a PDF file.
+
+The data is taken from the cached results of the analysis pipeline (see
+fluopi.pipeline), the figures are rendered in parallel worker processes and,
+to keep the rendering time bounded on plates with many colonies, series
+are aggregated: above max_series colonies only a sample of them is drawn
+over the median and 10-90 percentile band of all the colonies.
+"""
+import io
+import os
+import time
+import base64
+import datetime
+import multiprocessing
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import EllipseCollection
+from PIL import Image
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+
+from fluopi.analysis import CHANNELS, rois_time_sum, linear_fit
+from fluopi.plotting import rois_plt_fluo_dynam, _series_plot, RenderContext
+from fluopi.pipeline import Pipeline
+
+# Figures of the report, in order, with their captions
+FIGURES = ['detection', 'radius', 'area', 'fluorescence', 'channels']
+CAPTIONS = {
+    'detection': 'Colonies detected on the summarized image (see colony_blobs_id)',
+    'radius': 'Colony radius over time (see plot_radius)',
+    'area': 'Colony area over time and fitted sigmoid (see area and function_fit)',
+    'fluorescence': 'Total fluorescence of each colony over time (see rois_plt_fluo_dynam)',
+    'channels': 'Green vs red total fluorescence of the last frame (see linear_fit)',
+}
+
+
+def report_data(pipe):
+    """
+    Collect the results of a plate needed by the report figures
+
+    Parameters
+    ----------
+    pipe : Pipeline
+        analysis pipeline of the plate (the stages are computed if they
+        are not cached)
+
+    Returns
+    -------
+    data: dictionary
+        'Summary', 'Blobs', 'T', 'Cols', 'Radius', 'Area' and 'AreaFit'
+        ((colony x time) arrays, NaN for the colonies not fitted) and
+        'Traces' (see rois_time_sum)
+    """
+    cols = pipe.get('rois.Cols')
+    R = pipe.get('radius.Radius')
+    A = pipe.get('fit.Area')
+    fit = pipe.get('fit.Fit')
+    T = pipe.get('load.T')
+    data = {'Summary': pipe.get('smooth.Summary'), 'Blobs': pipe.get('detection.Blobs'),
+            'T': T, 'Cols': cols,
+            'Radius': np.array([R[i] for i in cols]).reshape((len(cols), len(T))),
+            'Area': np.array([A[i] for i in cols]).reshape((len(cols), len(T))),
+            'AreaFit': np.array([fit[i][0] if i in fit else np.full(len(T), np.nan)
+                                 for i in cols]).reshape((len(cols), len(T))),
+            'Traces': rois_time_sum(pipe.get('rois.Rois'), cols) if len(cols) else {}}
+    return(data)
+
+
+def _aggregate_plot(t, Y, max_series, max_points, labels='null'):
+    """
+    Plot the series as dots, only a sample of max_series of them over the
+    median and 10-90 percentile band when there are more
+    """
+    if len(Y) > max_series:
+        lo, med, hi = np.nanpercentile(Y, [10, 50, 90], axis=0)
+        plt.fill_between(t, lo, hi, color='0.85', label='10-90 percentile')
+        plt.plot(t, med, 'k-', label='median')
+        sample = np.random.RandomState(0).choice(len(Y), max_series, replace=False)
+        _series_plot(t, Y[np.sort(sample)], 'null', max_points)
+        plt.legend(loc='upper left')
+    else:
+        _series_plot(t, Y, labels, max_points)
+
+
+def fig_detection(data, max_series=200, max_points=200):
+    """
+    Summary image with the detected colonies (ids shown up to max_series colonies)
+    """
+    blobs = data['Blobs']
+    fig = plt.figure(figsize=(8,8))
+    ax = fig.gca()
+    ax.imshow(data['Summary'], cmap='gray')
+    if len(blobs):
+        # all the circles in one artist
+        d = 2*(2**0.5)*blobs[:,2]
+        ax.add_collection(EllipseCollection(d, d, np.zeros(len(d)), units='xy',
+                                            offsets=blobs[:,[1,0]], transOffset=ax.transData,
+                                            facecolors='none', edgecolors='r', linewidths=0.5))
+    if len(blobs) <= max_series:
+        for i in range(len(blobs)):
+            ax.annotate(i, xy=(blobs[i,1], blobs[i,0]), xytext=(-2, 2),
+                        textcoords='offset points', ha='right', va='bottom',
+                        color='white', fontsize=6)
+    ax.set_title(str(len(blobs)) + ' colonies detected')
+    ax.set_xticks([])
+    ax.set_yticks([])
+    return(fig)
+
+
+def fig_radius(data, max_series=200, max_points=200):
+    """
+    Radius of each colony over time
+    """
+    fig = plt.figure(figsize=(8,5))
+    labels = ['colony '+str(i) for i in data['Cols']] if len(data['Cols']) <= 10 else 'null'
+    _aggregate_plot(data['T'], data['Radius'], max_series, max_points, labels)
+    plt.xlabel('Time [h]')
+    plt.ylabel('Radius [pixels]')
+    plt.title('Colony radius')
+    return(fig)
+
+
+def fig_area(data, max_series=200, max_points=200):
+    """
+    Area of each colony over time and median of the fitted curves
+    """
+    fig = plt.figure(figsize=(8,5))
+    _aggregate_plot(data['T'], data['Area'], max_series, max_points)
+    fitted = np.isfinite(data['AreaFit']).all(axis=1)
+    if fitted.any():
+        plt.plot(data['T'], np.median(data['AreaFit'][fitted], axis=0), 'r-',
+                 label='median fit')
+        plt.legend(loc='upper left')
+    plt.xlabel('Time [h]')
+    plt.ylabel('Area $[pixels]^2$')
+    plt.title('Colonies Area (' + str(int(fitted.sum())) + ' fitted)')
+    return(fig)
+
+
+def fig_fluorescence(data, max_series=200, max_points=200):
+    """
+    Total fluorescence of each colony and channel over time, at most max_points time steps
+    """
+    traces = data['Traces']
+    T = len(data['T'])
+    rows = np.arange(len(data['Cols']))
+    if len(rows) > max_series:
+        rows = np.sort(np.random.RandomState(0).choice(len(rows), max_series, replace=False))
+    # same time steps for all the colonies (lines, not dots)
+    steps = np.unique(np.linspace(0, T-1, min(T, max_points)).astype(int))
+    sub = dict((c, traces[c][rows][:,steps]) for c in CHANNELS)
+    rois_plt_fluo_dynam(None, data['T'][steps], list(rows), traces=sub)
+    return(plt.gcf())
+
+
+def fig_channels(data, max_series=200, max_points=200):
+    """
+    Linear fit of the red vs green total fluorescence of the colonies on the last frame
+    """
+    x = data['Traces'][CHANNELS[1]][:,-1]
+    y = data['Traces'][CHANNELS[0]][:,-1]
+    linear_fit(x, y)
+    plt.xlabel(CHANNELS[1]+' Channel')
+    plt.ylabel(CHANNELS[0]+' Channel')
+    return(plt.gcf())
+
+
+def _render(args):
+    """
+    Worker: render one figure to PNG bytes (see fluopi.plotting.RenderContext)
+
+    Returns
+    -------
+    (name, png bytes, render time in secs, memory in bytes (0 if not profiled))
+    """
+    name, data, max_series, max_points, dpi, profile = args
+    png, secs, mem = None, 0, 0
+    with RenderContext(profile=profile) as ctx:
+        try:
+            t1 = time.time()
+            fig = ctx.call(globals()['fig_' + name], data, max_series, max_points)
+            buf = io.BytesIO()
+            fig.savefig(buf, format='png', dpi=dpi)
+            png = buf.getvalue()
+            secs = time.time() - t1
+            if profile:
+                mem = sum(s['memory'] for s in ctx.stats)
+        except Exception as e:
+            print('ERROR: figure ' + name + ' failed: ' + repr(e))
+    return((name, png, secs, mem))
+
+
+def _html(title, summary, figures):
+    title = escape(title)
+    rows = ''.join('<tr><th>%s</th><td>%s</td></tr>'%(escape(str(k)), escape(str(summary[k])))
+                   for k in summary)
+    body = ''
+    for name, png, secs, mem in figures:
+        if png is None:
+            continue
+        body += ('<figure><img src="data:image/png;base64,%s"/>'
+                 '<figcaption>%s <small>(%.2f s%s)</small></figcaption></figure>\n'
+                 %(base64.b64encode(png).decode('ascii'), CAPTIONS.get(name, name), secs,
+                   ', %.1f MB'%(mem/1e6) if mem else ''))
+    return('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>%s</title>'
+           '<style>body{font-family:sans-serif;max-width:900px;margin:auto}'
+           'img{max-width:100%%}th{text-align:left;padding-right:1em}'
+           'figure{margin:2em 0}</style></head>\n<body><h1>%s</h1>\n<table>%s</table>\n%s'
+           '</body></html>\n'%(title, title, rows, body))
+
+
+def plate_report(folder, params=None, out='null', formats=['html','pdf'], figures=FIGURES,
+                 processes=None, max_series=200, max_points=200, dpi=100, profile=False):
+    """
+    Make the report of a plate with the results of the analysis pipeline
+
+    Parameters
+    ----------
+    folder : string
+        experiment folder of the plate
+
+    params : dictionary
+        analysis parameters (see fluopi.pipeline.load_pipeline)
+
+    out : string
+        report filename without extension, default = 'report' on the
+        pipeline output folder
+
+    formats : list
+        'html' (self-contained, images embedded) and/or 'pdf'
+
+    figures : list
+        figures to include (see FIGURES)
+
+    processes : int
+        worker processes rendering the figures (default = number of CPUs,
+        1 = render on this process)
+
+    max_series : int
+        maximum number of colonies drawn on each plot (see module description)
+
+    max_points : int
+        maximum number of points of each series (see decimate_minmax)
+
+    dpi : int
+        resolution of the figures
+
+    profile : boolean
+        True to also measure the memory used by each figure (slower, see
+        fluopi.plotting.RenderContext)
+
+    Returns
+    -------
+    files: list
+        report files written
+    """
+    pipe = Pipeline(folder, params)
+    data = report_data(pipe)
+    if out == 'null':
+        out = os.path.join(pipe.cache, 'report')
+
+    jobs = [(name, data, max_series, max_points, dpi, profile) for name in figures]
+    if processes == 1:
+        rendered = [_render(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            rendered = pool.map(_render, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    fitted = np.isfinite(data['AreaFit']).all(axis=1)
+    summary = {'Folder': os.path.abspath(folder),
+               'Date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M'),
+               'Frames': len(data['T']),
+               'Duration [h]': round(float(data['T'][-1]-data['T'][0]), 2),
+               'Colonies': len(data['Cols']),
+               'Fitted colonies': int(fitted.sum()),
+               'Mean final radius [pixels]': (round(float(np.mean(data['Radius'][:,-1])), 2)
+                                              if len(data['Cols']) else '')}
+
+    files = []
+    if 'html' in formats:
+        with open(out + '.html', 'w') as f:
+            f.write(_html('FluoPi report: ' + os.path.basename(os.path.abspath(folder)),
+                          summary, rendered))
+        files.append(out + '.html')
+    if 'pdf' in formats:
+        pages = [Image.open(io.BytesIO(r[1])).convert('RGB') for r in rendered
+                 if r[1] is not None]
+        if len(pages):
+            pages[0].save(out + '.pdf', save_all=True, append_images=pages[1:],
+                          resolution=dpi)
+            files.append(out + '.pdf')
+
+    for name, _, secs, mem in rendered:
+        print(name + ': ' + str(round(secs, 2)) + ' secs' +
+              (', ' + str(round(mem/1e6, 1)) + ' MB' if mem else ''))
+    return(files)
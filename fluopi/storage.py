@@ -0,0 +1,182 @@
+import os
+import zlib
+import numpy as np
+import matplotlib.pyplot as plt
+
+from fluopi.analysis import CHANNELS, save_obj, load_obj, file_timestamp
+
+# Name of the metadata index stored in the root of each experiment store
+INDEX_NAME = 'index'
+CHUNK_NAME = 't%04d_x%04d_y%04d.chunk'
+
+
+def _chunk_path(store_path, ct, cx, cy):
+    return(os.path.join(store_path, 'chunks', CHUNK_NAME%(ct, cx, cy)))
+
+
+def _write_chunks(store_path, block, ct, tile, level):
+    """
+    Split a block of consecutive frames (time, x, y, channel) in spatial tiles
+    and write each of them as a compressed chunk
+    """
+    _, W, H, _ = block.shape
+    for cx in range(0, int(np.ceil(W/float(tile)))):
+        for cy in range(0, int(np.ceil(H/float(tile)))):
+            chunk = block[:, cx*tile:(cx+1)*tile, cy*tile:(cy+1)*tile, :]
+            with open(_chunk_path(store_path, ct, cx, cy), 'wb') as f:
+                f.write(zlib.compress(np.ascontiguousarray(chunk).tobytes(), level))
+
+
+def create_store(x_frames, image_count, f_name, store_path, init=0, t_chunk=16,
+                 tile=256, level=3):
+    """
+    Convert a sequence of image files into a chunked experiment store. Frames
+    are split in blocks of t_chunk time steps and square spatial tiles of side
+    tile, each one compressed in a separated file, so sub-regions and time
+    windows can be read back decoding only the chunks needed.
+
+    Parameters
+    ----------
+    x_frames : int
+        step frames (e.g 10 to use only ten to ten images)
+
+    image_count : int
+        total number of files on the folder (can be obtained with count_files function)
+
+    f_name : string
+        file name pattern including full path where images are stored, e.g. "/folder/image-%04d"
+
+    store_path : string
+        folder where the store is created
+
+    init: int
+        first image number name to be used
+
+    t_chunk: int
+        number of frames on each chunk
+
+    tile: int
+        side of the spatial tiles on each chunk (pixels)
+
+    level: int
+        zlib compression level (0-9)
+
+    Returns
+    -------
+    index: dictionary
+        metadata of the store: frames shape, chunking, source files and the
+        acquisition time of each frame (index['Timestamps'], seconds)
+
+    """
+    init = int(init)
+    NT = int(image_count/x_frames)
+    first = plt.imread(f_name%init)
+    W,H,_ = first.shape
+
+    if not os.path.exists(os.path.join(store_path, 'chunks')):
+        os.makedirs(os.path.join(store_path, 'chunks'))
+
+    files = []
+    timestamps = np.zeros((NT))
+    block = np.zeros((t_chunk, W, H, len(CHANNELS)), dtype=first.dtype)
+    for i in range(0,NT):
+        fname = f_name%(init + i*x_frames)
+        files.append(fname)
+        timestamps[i] = file_timestamp(fname)
+        block[i%t_chunk] = plt.imread(fname)[:,:,:len(CHANNELS)]
+        if i%t_chunk == t_chunk-1 or i == NT-1:
+            _write_chunks(store_path, block[:i%t_chunk+1], int(i/t_chunk), tile, level)
+
+    index = {}
+    index['Shape'] = (NT, W, H, len(CHANNELS))
+    index['dtype'] = str(first.dtype)
+    index['t_chunk'] = t_chunk
+    index['tile'] = tile
+    index['Files'] = files
+    index['Timestamps'] = timestamps
+    save_obj(index, INDEX_NAME, store_path)
+
+    return(index)
+
+
+def load_store_index(store_path):
+    """
+    Load the metadata index of an experiment store
+
+    Parameters
+    ----------
+    store_path : string
+        folder of the store (created with create_store function)
+
+    Returns
+    -------
+    index: dictionary
+        metadata of the store (see create_store)
+
+    """
+    return(load_obj(INDEX_NAME, store_path))
+
+
+def get_store_data(store_path, t_lims=None, x_lims=None, y_lims=None, index=None):
+    """
+    Load image data of a sub-region and time window from an experiment store,
+    decoding only the chunks which overlap it. The output is equivalent to
+    get_im_data over the same frames, sliced as [x_lims[0]:x_lims[1],
+    y_lims[0]:y_lims[1], t_lims[0]:t_lims[1]].
+
+    Parameters
+    ----------
+    store_path : string
+        folder of the store (created with create_store function)
+
+    t_lims: list
+        time window limits [t_min, t_max] in frame positions, default = all frames
+
+    x_lims: list
+        x-axis limits [x_min, x_max] of the region, default = whole image
+
+    y_lims: list
+        y-axis limits [y_min, y_max] of the region, default = whole image
+
+    index: dictionary
+        store metadata, to avoid reloading it on repeated calls
+
+    Returns
+    -------
+    ImsR,ImsG,ImsB: array_like
+        data per channel of the region (ImsR -> matrix size = (x, y, t))
+
+    """
+    if index is None:
+        index = load_store_index(store_path)
+    NT,W,H,NC = index['Shape']
+    tc = index['t_chunk']
+    tile = index['tile']
+
+    t1,t2 = t_lims if t_lims is not None else [0, NT]
+    x1,x2 = x_lims if x_lims is not None else [0, W]
+    y1,y2 = y_lims if y_lims is not None else [0, H]
+    t1,t2 = max(int(t1),0), min(int(t2),NT)
+    x1,x2 = max(int(x1),0), min(int(x2),W)
+    y1,y2 = max(int(y1),0), min(int(y2),H)
+
+    out = np.zeros((max(x2-x1,0), max(y2-y1,0), max(t2-t1,0), NC))
+
+    for ct in range(int(t1/tc), int(np.ceil(t2/float(tc)))):
+        nt = min(tc, NT-ct*tc)
+        for cx in range(int(x1/tile), int(np.ceil(x2/float(tile)))):
+            nx = min(tile, W-cx*tile)
+            for cy in range(int(y1/tile), int(np.ceil(y2/float(tile)))):
+                ny = min(tile, H-cy*tile)
+                with open(_chunk_path(store_path, ct, cx, cy), 'rb') as f:
+                    chunk = np.frombuffer(zlib.decompress(f.read()),
+                                          dtype=index['dtype']).reshape((nt,nx,ny,NC))
+                # overlap between the chunk and the requested region
+                ta,tb = max(t1,ct*tc), min(t2,ct*tc+nt)
+                xa,xb = max(x1,cx*tile), min(x2,cx*tile+nx)
+                ya,yb = max(y1,cy*tile), min(y2,cy*tile+ny)
+                out[xa-x1:xb-x1, ya-y1:yb-y1, ta-t1:tb-t1, :] = \
+                    chunk[ta-ct*tc:tb-ct*tc, xa-cx*tile:xb-cx*tile,
+                          ya-cy*tile:yb-cy*tile, :].transpose((1,2,0,3))
+
+    return(out[:,:,:,0], out[:,:,:,1], out[:,:,:,2])
@@ -0,0 +1,220 @@
+import numpy as np
+
+from fluopi.analysis import CHANNELS, imread_reduced, bg_grid, bg_weights
+
+
+class FrameAccumulator(object):
+    """
+    Accumulate summary images of a time-lapse frame by frame, without keeping
+    the whole stack in memory. For each channel it keeps the sum, mean,
+    maximum and variance over time of every pixel (float64 accumulators,
+    Welford update for the variance).
+
+    Use update() with each new frame (e.g. as it is decoded or captured) and
+    get the summary images at any time with sum(), mean(), max(), var() or
+    sum_image() (equivalent to data_sum_time).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._sum = {}
+        self._mean = {}
+        self._m2 = {}
+        self._max = {}
+
+    def update(self, im):
+        """
+        Add a new frame to the accumulators
+
+        Parameters
+        ----------
+        im: array_like
+            image data of the frame (W,H,channels), e.g. from plt.imread
+        """
+        self.count += 1
+        for k in range(len(CHANNELS)):
+            c = CHANNELS[k]
+            x = im[:,:,k]
+            if self.count == 1:
+                self._sum[c] = np.zeros(x.shape)
+                self._mean[c] = np.zeros(x.shape)
+                self._m2[c] = np.zeros(x.shape)
+                self._max[c] = np.array(x, copy=True)
+            else:
+                np.maximum(self._max[c], x, out=self._max[c])
+
+            self._sum[c] += x
+            delta = x - self._mean[c]
+            self._mean[c] += delta/self.count
+            self._m2[c] += delta*(x - self._mean[c])
+
+    def sum(self):
+        """
+        Returns
+        -------
+        dictionary with the sum over time of each channel
+        """
+        return(self._sum)
+
+    def mean(self):
+        """
+        Returns
+        -------
+        dictionary with the mean over time of each channel
+        """
+        return(self._mean)
+
+    def max(self):
+        """
+        Returns
+        -------
+        dictionary with the maximum over time of each channel
+        """
+        return(self._max)
+
+    def var(self, ddof=0):
+        """
+        Parameters
+        ----------
+        ddof: int
+            delta degrees of freedom (0 = population variance)
+
+        Returns
+        -------
+        dictionary with the variance over time of each channel
+        """
+        var = {}
+        for c in CHANNELS:
+            var[c] = self._m2[c]/max(self.count-ddof, 1)
+        return(var)
+
+    def sum_image(self):
+        """
+        Returns
+        -------
+        SData: array like
+            Sum data over time and over channels for each pixel (same as
+            data_sum_time), to be used for colony detection
+        """
+        return(self._sum[CHANNELS[0]] + self._sum[CHANNELS[1]] + self._sum[CHANNELS[2]])
+
+
+class BackgroundEstimator(object):
+    """
+    Incremental version of bg_grid/bg_surface_subst for frames arriving one
+    by one. Each update() estimates the tiled background of the new frame,
+    stores its tile values and returns the frame with the background
+    substracted. The interpolation weights are computed only once.
+
+    Parameters
+    ----------
+    tile : int
+        side of the square tiles (pixels)
+
+    percentile: double
+        percentile of each tile used as background value (50 = median)
+    """
+
+    def __init__(self, tile=64, percentile=50):
+        self.tile = tile
+        self.percentile = percentile
+        self._grid = dict((c, []) for c in CHANNELS)
+        self._weights = None
+
+    def update(self, im):
+        """
+        Estimate the background of a new frame and substract it
+
+        Parameters
+        ----------
+        im: array_like
+            image data of the frame (W,H,channels)
+
+        Returns
+        -------
+        frame: dictionary
+            background substracted data of each channel (values < 0 set to 0)
+        """
+        data = {}
+        for k in range(len(CHANNELS)):
+            data[CHANNELS[k]] = im[:,:,k:k+1]
+        grid = bg_grid(data, self.tile, self.percentile)
+
+        if self._weights is None:
+            nx,ny,_ = grid[CHANNELS[0]].shape
+            self._weights = (bg_weights(im.shape[0], nx, self.tile),
+                             bg_weights(im.shape[1], ny, self.tile))
+        for c in CHANNELS:
+            self._grid[c].append(grid[c][:,:,0])
+        bg = self.surface(-1)
+
+        frame = {}
+        for c in CHANNELS:
+            frame[c] = data[c][:,:,0] - bg[c]
+            frame[c][frame[c]<0] = 0
+        return(frame)
+
+    def surface(self, i):
+        """
+        Parameters
+        ----------
+        i: int
+            position of the frame (in order of arrival)
+
+        Returns
+        -------
+        bg: dictionary
+            full resolution background surface of each channel for frame i
+        """
+        WX,WY = self._weights
+        bg = {}
+        for c in CHANNELS:
+            bg[c] = WX.dot(self._grid[c][i]).dot(WY.T)
+        return(bg)
+
+    def grid(self):
+        """
+        Returns
+        -------
+        grid: dictionary
+            background value of each tile, channel and frame received, with the
+            same format as bg_grid
+        """
+        grid = {}
+        for c in CHANNELS:
+            grid[c] = np.dstack(self._grid[c])
+        return(grid)
+
+
+def accumulate_files(x_frames, image_count, f_name, init=0, scale=1):
+    """
+    Compute the summary images of a sequence of files decoding one frame at a
+    time (see FrameAccumulator). The arguments are the same as get_im_data.
+
+    Parameters
+    ----------
+    x_frames : int
+        step frames (e.g 10 to use only ten to ten images)
+
+    image_count : int
+        total number of files on the folder (can be obtained with count_files function)
+
+    f_name : string
+        file name pattern including full path where images are stored, e.g. "/folder/image-%04d"
+
+    init: int
+        first image number name to be used in the analysis.
+
+    scale: int
+        reduction factor of the image resolution (see imread_reduced)
+
+    Returns
+    -------
+    acc: FrameAccumulator
+        accumulators updated with every frame
+    """
+    acc = FrameAccumulator()
+    init = int(init)
+    for i in range(0, int(image_count/x_frames)):
+        acc.update(imread_reduced(f_name%(init + i*x_frames), scale))
+    return(acc)